@@ -0,0 +1,40 @@
+#!/usr/bin/env python3
+"""Compare the rendering speed of the html.parser and expat backends on
+tests/render_tests and on the chapters of the given epubs.
+
+    PYTHONPATH=. python benchmarks/parser.py [EPUB...]
+"""
+from glob import glob
+import sys
+import timeit
+import xml.parsers.expat
+
+from termpub.epub import Epub
+from termpub.renderer import Renderer
+
+def well_formed(html):
+    parser = xml.parsers.expat.ParserCreate()
+    try:
+        parser.Parse(html, True)
+        return True
+    except xml.parsers.expat.ExpatError:
+        return False
+
+def corpus():
+    sources = []
+    for file in glob('tests/render_tests/*.txt'):
+        with open(file) as fh:
+            sources.append(fh.read().split('\n\f\n')[0])
+    yield 'render_tests', sources
+    for file in sys.argv[1:]:
+        yield file, [chapter.source for chapter in Epub(file).chapters]
+
+for name, sources in corpus():
+    sources = [x for x in sources if well_formed(x)]
+    size = sum(len(x) for x in sources)
+    print(f'{name}: {len(sources)} well-formed documents, {size} bytes')
+    for parser in ('html', 'xml', 'auto'):
+        seconds = min(timeit.repeat(
+            lambda: [Renderer(parser=parser).render(x) for x in sources],
+            number=1, repeat=3))
+        print(f'  {parser:5} {seconds * 1000:8.1f} ms')
@@ -0,0 +1,22 @@
+#!/usr/bin/env python3
+"""Time rendering a long chapter of plain prose.
+
+    PYTHONPATH=. python benchmarks/render.py
+"""
+import random
+import timeit
+
+from termpub.renderer import Renderer
+
+rng = random.Random(1)
+vocabulary = ('the quick brown fox jumps over the lazy dog and some '
+    'extraordinary internationalization happens here').split()
+paragraphs = [
+    '<p>' + ' '.join(rng.choice(vocabulary) for _ in range(150)) + '</p>'
+    for _ in range(2000)]
+html = '<html><body>' + '\n'.join(paragraphs) + '</body></html>'
+
+for fill in ('greedy', 'optimal'):
+    seconds = min(timeit.repeat(
+        lambda: Renderer(80, fill=fill).render(html), number=1, repeat=3))
+    print(f'{fill:8} {len(html) / seconds / 1e6:6.2f} MB/s')
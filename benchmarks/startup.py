@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+"""Show the modules imported by the non-interactive modes and how long
+they take, as reported by python -X importtime.
+
+    PYTHONPATH=. python benchmarks/startup.py [EPUB]
+"""
+import os
+import subprocess
+import sys
+
+def importtime(args):
+    """Return (total, {module: cumulative}) in microseconds, total being
+    the time spent in all top level imports."""
+    result = subprocess.run([sys.executable, '-X', 'importtime'] + args,
+        stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+        universal_newlines=True)
+    total = 0
+    modules = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        modules[name.strip()] = int(cumulative)
+        if not name[1:].startswith(' '):
+            total += int(cumulative)
+    return total, modules
+
+epub = next((x for x in sys.argv[1:] if not x.startswith('-')), None)
+runs = {'--help': ['-m', 'termpub', '--help']}
+if epub:
+    runs['--dump'] = ['-m', 'termpub', '--dump', epub]
+
+for name, args in runs.items():
+    total, modules = importtime(args)
+    termpub = sorted(x for x in modules if x.startswith('termpub'))
+    print(f'{name}: {total / 1000:.1f} ms importing, '
+        f'{len(modules)} modules')
+    print('   ', ' '.join(termpub))
+    for heavy in ('curses', 'sqlite3', 'tempfile', 'xml.dom.minidom',
+            'pyphen'):
+        if heavy in modules:
+            print(f'    {heavy} imported ({modules[heavy] / 1000:.1f} ms)')
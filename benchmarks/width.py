@@ -0,0 +1,33 @@
+#!/usr/bin/env python3
+"""Compare termpub.width.width with the previous implementation, which
+counted the non-combining characters of every chunk.
+
+    PYTHONPATH=. python benchmarks/width.py
+"""
+import random
+import timeit
+import unicodedata
+
+from termpub.width import width
+
+def old_width(chunk):
+    return len([c for c in chunk if not unicodedata.combining(c)])
+
+def words(alphabet, count=20000, seed=1):
+    rng = random.Random(seed)
+    vocabulary = [
+        ''.join(rng.choice(alphabet) for _ in range(rng.randint(1, 10)))
+        for _ in range(2000)]
+    return [rng.choice(vocabulary) for _ in range(count)]
+
+texts = {
+    'ascii': words('abcdefghijklmnopqrstuvwxyz'),
+    'latin': words('abcdefghijklmnopqrstuvwxyzäöüßéèàç'),
+    'cjk': words('的一是不了人我在有他这为之大来以个中上们到说国和地也子时道出就'),
+}
+
+for name, chunks in texts.items():
+    for function in (old_width, width):
+        seconds = min(timeit.repeat(
+            lambda: [function(x) for x in chunks], number=5, repeat=3))
+        print(f'{name:6} {function.__name__:10} {seconds * 1000:8.1f} ms')
@@ -1,34 +1,41 @@
-from pathlib import Path
 import argparse
-import curses
 import locale
 import os
-import shlex
 import sys
 import zipfile
 
-from termpub.commands import parse_command, CommandException 
-from termpub.reader import Reader
+from termpub.commands import parse_command, parse_bool, CommandException 
 import termpub.epub as epub_parser
-import termpub.readline as readline
-import termpub.renderer as renderer
-import termpub.width as width
 
-locale.setlocale(locale.LC_ALL, '')
-code = locale.getpreferredencoding()
+## Only what every mode needs is imported here. The reader and curses
+## are loaded just before the interactive mode starts, so --help, --dump
+## and the other non-interactive modes stay fast.
 
 class ConfigError(Exception):
     pass
 
+## options that are switched on or off in the termpubrc
+BOOLEAN_OPTIONS = ('hyphenate', 'windowed', 'smartcase', 'literal')
+
 def die(msg):
     print('termpub:', msg, file=sys.stderr)
     sys.exit(1)
 
 def enter_curses(stdscr, epub, config, keys):
+    import curses
+    from termpub.reader import Reader
     curses.raw()
     reader = Reader(epub, stdscr, **config)
     reader.keys = { **reader.keys, **keys }
-    reader.update()
+    status = None
+    try:
+        reader.update()
+    except SystemExit as e:
+        ## raised by the SIGHUP and SIGTERM handler
+        status = e.code
+    finally:
+        reader.exit()
+    return reader.exit_message, status
 
 def find_config_file():
     config_home = os.environ.get(
@@ -51,8 +58,43 @@ def read_config_file(config_file):
                 keys[args[0]] = args[1]
     return dict, keys
 
+def xdg_dir(variable, default):
+    """Return the termpub directory below an XDG base directory."""
+    return os.path.join(
+        os.environ.get(variable, os.path.expanduser(default)), 'termpub')
+
+def start_library(argv):
+    from termpub.library import main
+    data_dir = xdg_dir('XDG_DATA_HOME', '~/.local/share/')
+    os.makedirs(data_dir, exist_ok=True)
+    sys.exit(main(argv, os.path.join(data_dir, 'library.sqlite')))
+
+def start_search(argv):
+    """Run termpub search, return the arguments to open a hit with."""
+    from termpub.fulltext import main
+    data_dir = xdg_dir('XDG_DATA_HOME', '~/.local/share/')
+    os.makedirs(data_dir, exist_ok=True)
+    result = main(argv, os.path.join(data_dir, 'fulltext.sqlite'),
+        os.path.join(data_dir, 'library.sqlite'))
+    if isinstance(result, tuple):
+        path, chapter, position = result
+        return ['--goto', f'{chapter}:{position}', path]
+    sys.exit(result)
+
+def start_convert(argv):
+    from termpub.convert import main
+    sys.exit(main(argv))
+
 def start_cli():
 
+    argv = sys.argv[1:]
+    if argv[:1] == ['library']:
+        start_library(argv[1:])
+    if argv[:1] == ['convert']:
+        start_convert(argv[1:])
+    if argv[:1] == ['search']:
+        argv = start_search(argv[1:])
+
     parser = argparse.ArgumentParser(description="View epubs")
     parser.add_argument('file', metavar='FILE', help='Epub to display')
     parser.add_argument(
@@ -61,10 +103,18 @@ def start_cli():
     parser.add_argument('--width', type=int, help='set width')
     parser.add_argument(
         '--dump', action='store_true', help='dump rendered epub to stdout')
+    parser.add_argument('--jobs', type=int, metavar='N',
+        help='render chapters in N processes when dumping, 0 for all cpus')
+    parser.add_argument('--fill', choices=['greedy', 'optimal'],
+        help='how paragraphs are broken into lines')
+    parser.add_argument('--goto', metavar='CHAPTER:POSITION',
+        help='open the book at a position, as printed by termpub search')
 
     defaults = {
         'width': 80,
         'language': 'en_US',
+        'jobs': 1,
+        'fill': 'greedy',
     }
     keys = {}
     config = {}
@@ -76,35 +126,70 @@ def start_cli():
     defaults = {**defaults, **config}
     parser.set_defaults(**defaults)
 
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
     args = vars(args)
 
     file = args['file']
     del args['file']
 
+    for option in BOOLEAN_OPTIONS:
+        if option in args:
+            try:
+                args[option] = parse_bool(args[option], option)
+            except CommandException as e:
+                die(e.msg)
+
     try:
-        epub = epub_parser.Epub(file)
+        ## only keep the sources of a few recently viewed chapters around
+        epub = epub_parser.Epub(file, cache_size=16)
     except (zipfile.BadZipFile, IsADirectoryError, FileNotFoundError) as e:
         die(f'"{file}" is not an epub file.')
 
     if args.get('dump'):
-        from termpub.renderer import Renderer
-        for chapter in epub.chapters:
-            lines, _, _ = Renderer().render(chapter.source)
-            for line in lines:
-                print(line)
+        from termpub.dump import dump
+        dump(epub, width=args['width'], hyphenate=args['hyphenate'],
+            language=args['language'], jobs=args['jobs'], fill=args['fill'])
         sys.exit(0)
     del args['dump']
+    del args['jobs']
+
+    if args['goto']:
+        chapter, _, position = args['goto'].rpartition(':')
+        if not chapter or not position.isdigit():
+            die(f'Invalid position "{args["goto"]}".')
+        args['goto'] = (chapter, int(position))
+
+    xdg_data_dir = xdg_dir('XDG_DATA_HOME', '~/.local/share/')
 
     if args.get('dbfile') is None:
-        xdg_data_dir = Path(
-            os.environ.get(
-                'XDG_DATA_HOME', os.path.expanduser('~/.local/share/')),
-            'termpub')
-        xdg_data_dir.mkdir(parents=True, exist_ok=True)
-        args['dbfile'] = str(xdg_data_dir.joinpath('termpub.sqlite'))
-
-    curses.wrapper(enter_curses, epub, args, keys)
+        os.makedirs(xdg_data_dir, exist_ok=True)
+        args['dbfile'] = os.path.join(xdg_data_dir, 'termpub.sqlite')
+
+    if args.get('searchfile') is None:
+        os.makedirs(xdg_data_dir, exist_ok=True)
+        args['searchfile'] = os.path.join(xdg_data_dir, 'search.sqlite')
+
+    xdg_cache_dir = xdg_dir('XDG_CACHE_HOME', '~/.cache/')
+
+    if args.get('cachefile') is None:
+        os.makedirs(xdg_cache_dir, exist_ok=True)
+        args['cachefile'] = os.path.join(xdg_cache_dir, 'render.sqlite')
+
+    if args.get('resourcedir') is None:
+        args['resourcedir'] = os.path.join(xdg_cache_dir, 'resources')
+
+    if args.get('hyphenfile') is None:
+        os.makedirs(xdg_cache_dir, exist_ok=True)
+        args['hyphenfile'] = os.path.join(
+            xdg_cache_dir, 'hyphenation.sqlite')
+
+    import curses
+    locale.setlocale(locale.LC_ALL, '')
+    message, status = curses.wrapper(enter_curses, epub, args, keys)
+    if message:
+        print('termpub:', message, file=sys.stderr)
+    if message or status:
+        sys.exit(status or 1)
 
 def main():
     try:
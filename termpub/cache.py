@@ -0,0 +1,96 @@
+import json
+import sqlite3
+import threading
+import time
+import urllib.parse
+import zlib
+
+from termpub.renderer import Renderer
+
+def evict(con, table, max_size):
+    """Delete the least recently used rows of table until the sizes of
+    the remaining ones add up to at most max_size. table needs size and
+    last_used columns."""
+    total = con.execute(
+        f'SELECT COALESCE(SUM(size), 0) FROM {table}').fetchone()[0]
+    if total <= max_size:
+        return
+    cur = con.execute(f'SELECT rowid, size FROM {table} ORDER BY last_used')
+    expired = []
+    for rowid, size in cur.fetchall():
+        if total <= max_size:
+            break
+        expired.append((rowid,))
+        total -= size
+    con.executemany(f'DELETE FROM {table} WHERE rowid = ?', expired)
+
+class RenderCache():
+    """Persistent cache of rendered chapters.
+
+    Entries are keyed by the epub hash, chapter file, width and
+    hyphenation language. Entries written by another renderer version are
+    dropped on open, and the least recently used entries are evicted once
+    the cache grows beyond max_size bytes. The cache can be shared
+    between threads."""
+
+    def __init__(self, file, max_size=64 * 1024 * 1024):
+        self.file = file
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self.con = sqlite3.connect(file, check_same_thread=False)
+        with self.con:
+            self.con.execute("""
+                CREATE TABLE IF NOT EXISTS chapters (
+                    hash      TEXT NOT NULL,
+                    file      TEXT NOT NULL,
+                    width     INTEGER NOT NULL,
+                    language  TEXT NOT NULL,
+                    version   INTEGER NOT NULL,
+                    size      INTEGER NOT NULL,
+                    last_used REAL NOT NULL,
+                    data      BLOB NOT NULL,
+                    PRIMARY KEY (hash, file, width, language)
+                )
+            """)
+            self.con.execute(
+                'CREATE INDEX IF NOT EXISTS chapters_last_used '
+                'ON chapters (last_used)')
+            self.con.execute(
+                'DELETE FROM chapters WHERE version != ?',
+                (Renderer.version,))
+
+    def get(self, hash, file, width, language=''):
+        key = (hash, file, width, language or '')
+        with self.lock:
+            cur = self.con.execute("""
+                SELECT data FROM chapters
+                WHERE hash = ? AND file = ? AND width = ? AND language = ?
+            """, key)
+            row = cur.fetchone()
+            if row is None:
+                return None
+            with self.con:
+                self.con.execute("""
+                    UPDATE chapters SET last_used = ?
+                    WHERE hash = ? AND file = ? AND width = ? AND language = ?
+                """, (time.time(), *key))
+        data = json.loads(zlib.decompress(row[0]))
+        locations = [urllib.parse.ParseResult(*x) for x in data['locations']]
+        return data['lines'], data['ids'], locations
+
+    def put(self, hash, file, width, language, lines, ids, locations):
+        data = zlib.compress(json.dumps({
+            'lines': lines,
+            'ids': ids,
+            'locations': [list(x) for x in locations],
+        }).encode())
+        with self.lock, self.con:
+            self.con.execute(
+                'INSERT OR REPLACE INTO chapters VALUES (?,?,?,?,?,?,?,?)',
+                (hash, file, width, language or '', Renderer.version,
+                    len(data), time.time(), data))
+            evict(self.con, 'chapters', self.max_size)
+
+    def close(self):
+        with self.lock:
+            self.con.close()
@@ -15,3 +15,14 @@ def parse_command(line):
     elif args[1] in ('0', 'false', 'off'):
         args[1] = False
     return command, *args
+
+def parse_bool(value, name):
+    """Return the boolean value of an option, set in a termpubrc as on/off,
+    true/false, yes/no or 1/0."""
+    if isinstance(value, bool):
+        return value
+    if str(value).lower() in ('1', 'true', 'on', 'yes'):
+        return True
+    if str(value).lower() in ('0', 'false', 'off', 'no'):
+        return False
+    raise CommandException(f'Invalid value "{value}" for {name}, use on or off')
@@ -0,0 +1,151 @@
+import argparse
+import os
+import sys
+import time
+
+from termpub import dump
+
+suffixes = {
+    'txt': '.txt',
+    'markdown': '.md',
+}
+
+def outputs(paths, suffix, directory=None):
+    """Yield (epub, output file) for all epubs in or at paths.
+
+    Without directory every output is written next to its epub. With
+    directory, books found below a directory keep their relative path
+    in it and single files are written to its top."""
+    from termpub.library import find_epubs
+
+    for path in paths:
+        root = os.path.abspath(path)
+        if not os.path.isdir(root):
+            root = os.path.dirname(root)
+        for epub in find_epubs([path]):
+            name = os.path.relpath(epub, root)
+            name = os.path.splitext(name)[0] + suffix
+            if directory is None:
+                yield epub, os.path.join(root, name)
+            else:
+                yield epub, os.path.join(directory, name)
+
+def write_book(out, format):
+    """Write the rendered chapters of the book set up by dump.init_worker
+    to out. The links of each chapter are listed after it, by the numbers
+    they have in the text."""
+    epub = dump.worker['epub']
+    for index, chapter in enumerate(epub.chapters):
+        if index:
+            out.write('\n')
+        renderer = dump.renderer(chapter)
+        if format == 'markdown':
+            renderer.heading_mark = '#'
+        lines, _, locations = renderer.render(chapter.source)
+        for line in lines:
+            out.write(line + '\n')
+        if locations:
+            out.write('\n')
+        for number, url in enumerate(locations, 1):
+            if format == 'markdown':
+                out.write(f'[{number}]: <{url.geturl()}>\n')
+            else:
+                out.write(f'[{number}] {url.geturl()}\n')
+
+def convert_book(epub, output, format='txt', width=80, hyphenate=False,
+        language=None, fill='greedy'):
+    """Convert one book and return (epub, output, seconds, error). This
+    runs in the conversion workers and never raises."""
+    start = time.perf_counter()
+    try:
+        dump.init_worker(epub, width, None, fill)
+        if hyphenate:
+            from termpub.hyphenation import Hyphenator
+            dump.worker['dic'] = Hyphenator(
+                dump.worker['epub'].language or language)
+        os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+        ## written to a temporary name, so a failed book leaves no
+        ## partial output
+        with open(output + '.part', 'w') as out:
+            write_book(out, format)
+        os.replace(output + '.part', output)
+        error = None
+    except Exception as e:
+        if os.path.exists(output + '.part'):
+            os.remove(output + '.part')
+        error = str(e) or e.__class__.__name__
+    return epub, output, time.perf_counter() - start, error
+
+def convert(books, jobs=1, out=sys.stderr, **options):
+    """Convert (epub, output) pairs in a pool of jobs processes shared by
+    all books, report each book to out and return the number of failed
+    books."""
+    if jobs == 0:
+        jobs = os.cpu_count() or 1
+
+    failed = 0
+    targets = {}
+    unique = []
+    for epub, output in books:
+        if output in targets:
+            failed += 1
+            out.write(f'failed\t{epub}: {output} is already written '
+                f'for {targets[output]}\n')
+        else:
+            targets[output] = epub
+            unique.append((epub, output))
+    books, count = unique, len(books)
+
+    if jobs <= 1:
+        results = (convert_book(*book, **options) for book in books)
+        executor = None
+    else:
+        from concurrent.futures import ProcessPoolExecutor, as_completed
+        executor = ProcessPoolExecutor(max_workers=jobs)
+        results = as_completed(
+            [executor.submit(convert_book, *book, **options)
+                for book in books])
+        results = (future.result() for future in results)
+
+    total = time.perf_counter()
+    try:
+        for epub, output, seconds, error in results:
+            if error:
+                failed += 1
+                out.write(f'failed\t{epub}: {error}\n')
+            else:
+                out.write(f'{seconds:.2f}s\t{epub} -> {output}\n')
+            out.flush()
+    finally:
+        if executor:
+            executor.shutdown()
+    total = time.perf_counter() - total
+    out.write(f'{count} books, {failed} failed, {total:.2f}s\n')
+    return failed
+
+def main(argv):
+    parser = argparse.ArgumentParser(prog='termpub convert',
+        description='Convert epubs to plain text or markdown')
+    parser.add_argument('paths', metavar='PATH', nargs='+',
+        help='directory or epub to convert')
+    parser.add_argument('--format', choices=list(suffixes), default='txt',
+        help='output format')
+    parser.add_argument('--output-dir', metavar='DIR',
+        help='write output files to DIR instead of next to the epubs')
+    parser.add_argument('--width', type=int, default=80, help='set width')
+    parser.add_argument('--hyphenate', action='store_true',
+        help='hyphenate text')
+    parser.add_argument('--language', default='en_US',
+        help='set language for hyphenation')
+    parser.add_argument('--fill', choices=['greedy', 'optimal'],
+        default='greedy', help='how paragraphs are broken into lines')
+    parser.add_argument('--jobs', type=int, metavar='N', default=0,
+        help='convert books in N processes, 0 for all cpus')
+
+    args = parser.parse_args(argv)
+    books = list(outputs(
+        args.paths, suffixes[args.format], args.output_dir))
+    failed = convert(books, jobs=args.jobs, format=args.format,
+        width=args.width, hyphenate=args.hyphenate, language=args.language,
+        fill=args.fill)
+    return 1 if failed else 0
@@ -0,0 +1,70 @@
+import collections
+import os
+import sys
+
+from termpub.epub import Epub
+from termpub.renderer import Renderer
+
+## State of a dump worker process, set up once by init_worker.
+worker = {}
+
+def init_worker(file, width, language, fill='greedy'):
+    worker['epub'] = Epub(file)
+    worker['width'] = width
+    worker['dic'] = None
+    if language:
+        from termpub.hyphenation import Hyphenator
+        worker['dic'] = Hyphenator(language)
+    worker['fill'] = fill
+
+def renderer(chapter):
+    return Renderer(worker['width'], dic=worker['dic'], base_url=chapter.file,
+        fill=worker['fill'])
+
+def render_chapter(index):
+    chapter = worker['epub'].chapters[index]
+    lines, _, _ = renderer(chapter).render(chapter.source)
+    return lines
+
+def render_book(file, width=80, language=None, jobs=1, fill='greedy'):
+    """Yield the rendered lines of every chapter in spine order.
+
+    Every chapter is rendered completely before its lines are yielded,
+    as a chapter that is not well-formed XML may be rendered again from
+    the start. With more than one job the chapters are rendered in a
+    process pool. Only a few chapters more than there are jobs are in
+    flight at any time, so memory stays bounded however large the book
+    is."""
+
+    init_worker(file, width, language, fill)
+    count = len(worker['epub'].chapters)
+
+    if jobs <= 1:
+        for index in range(count):
+            yield render_chapter(index)
+        return
+
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor(max_workers=jobs, initializer=init_worker,
+            initargs=(file, width, language, fill)) as executor:
+        pending = collections.deque()
+        index = 0
+        while index < count or pending:
+            while index < count and len(pending) < jobs * 2:
+                pending.append(executor.submit(render_chapter, index))
+                index += 1
+            yield pending.popleft().result()
+
+def dump(epub, width=80, hyphenate=False, language=None, jobs=1,
+        fill='greedy', out=sys.stdout):
+    if hyphenate:
+        language = epub.language or language
+    else:
+        language = None
+
+    if jobs == 0:
+        jobs = os.cpu_count() or 1
+
+    for lines in render_book(epub.file, width, language, jobs, fill):
+        for line in lines:
+            out.write(line + '\n')
@@ -1,10 +1,14 @@
-from hashlib import blake2b
+from collections import OrderedDict
 import array
 import functools
 import html
+import mmap
 import os
+import struct
+import threading
 import posixpath
 import urllib.parse
+import weakref
 import xml.etree.ElementTree as ET
 import zipfile
 
@@ -20,22 +24,54 @@ class Epub:
         "daisy": "http://www.daisy.org/z3986/2005/ncx/",
     }
 
-    def __init__(self, file):
+    def __init__(self, file, cache_size=None, member_budget=32 * 1024 * 1024):
         self.file = file
         self.zip = zipfile.ZipFile(file)
+        ## Stored members of read-only files are viewed straight from the
+        ## mapped file. It is only used while its size and modification time
+        ## are the ones it had when it was mapped.
+        self.map, self.map_stat = None, None
+        mapped = map_file(file)
+        if mapped:
+            fh, self.map = mapped
+            weakref.finalize(self, fh.close)
+            self.map_fileno = fh.fileno()
+            self.map_stat = self.file_stat()
+        self._hash = None
 
-        container = ET.parse(self.zip.open("META-INF/container.xml"))
+        ## Every member is decompressed once and kept while it fits into
+        ## member_budget bytes.
+        self.members = MemberCache(member_budget)
+
+        ## Decoded chapter sources are kept in a bounded LRU if cache_size
+        ## is set, otherwise every chapter keeps its source once read.
+        self.source_cache = None
+        if cache_size:
+            self.source_cache = SourceCache(cache_size)
+
+        container = ET.fromstring(self.read("META-INF/container.xml"))
         self.rootfile = container.find(
             "cont:rootfiles/cont:rootfile", self.NS).get("full-path")
 
         if self.rootfile is None:
             raise Exception('Missing root file in epub!')
 
-        self.root = ET.parse(self.zip.open(self.rootfile))
+    ## The package document is parsed on first use.
+    @functools.cached_property
+    def root(self):
+        return ET.fromstring(self.read(self.rootfile))
+
+    @functools.cached_property
+    def title(self):
+        return self.find_text('.//dc:title', 'Unknown')
 
-        self.title = self.find_text('.//dc:title', 'Unknown')
-        self.language = self.find_text('.//dc:langauge')
-        self.author = self.find_text('.//dc:creator', 'Unknown')
+    @functools.cached_property
+    def language(self):
+        return self.find_text('.//dc:language')
+
+    @functools.cached_property
+    def author(self):
+        return self.find_text('.//dc:creator', 'Unknown')
 
     def find_text(self, xpath, default=None):
         try:
@@ -44,16 +80,97 @@ class Epub:
         except AttributeError:
             return default
 
+    def read(self, name, cache=True):
+        """Return the contents of member name as bytes. Unless cache is
+        False, they are kept in the member cache. This always goes through
+        zipfile, which checks the CRC of the member."""
+        data = self.members.get(name)
+        if data is None:
+            data = self.zip.read(name)
+            if cache:
+                self.members.put(name, data)
+        return data
+
+    def view(self, name):
+        """Return the contents of member name as a memoryview.
+
+        Members stored without compression are returned directly from the
+        memory mapped file, without copying them."""
+        view = self.mapped(name)
+        if view is None:
+            view = memoryview(self.read(name))
+        return view
+
+    def mapped(self, name):
+        """Return a memoryview of a stored member in the mapped file, or
+        None if it is compressed or the file changed since it was mapped."""
+        if not self.map:
+            return None
+        if self.file_stat() != self.map_stat:
+            ## touching a mapping of a truncated file raises SIGBUS, views
+            ## given out before can not be helped
+            self.map = None
+            return None
+        info = self.zip.getinfo(name)
+        if info.compress_type != zipfile.ZIP_STORED or info.flag_bits & 0x1:
+            return None
+        start = self.data_offset(info)
+        if start is None:
+            return None
+        return memoryview(self.map)[start:start + info.file_size]
+
+    def data_offset(self, info):
+        """Return the offset of the data of a member in the file or None if
+        its local header is broken."""
+        header = self.map[info.header_offset:info.header_offset + 30]
+        if len(header) < 30 or header[:4] != b'PK\x03\x04':
+            return None
+        name_size, extra_size = struct.unpack('<HH', header[26:30])
+        start = info.header_offset + 30 + name_size + extra_size
+        if start + info.file_size > len(self.map):
+            return None
+        return start
+
+    def export(self, name, directory):
+        """Write member name below directory, unless it is already there,
+        and return the path of the file."""
+        parts = [x for x in name.split('/') if x not in ('', '.', '..')]
+        path = os.path.join(directory, *parts)
+        info = self.zip.getinfo(name)
+        if os.path.isfile(path) and os.path.getsize(path) == info.file_size:
+            return path
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + '.part', 'wb') as fh:
+            fh.write(self.view(name))
+        os.replace(path + '.part', path)
+        return path
+
+    def file_stat(self):
+        """Return size and modification time of the mapped file."""
+        stat = os.fstat(self.map_fileno)
+        return stat.st_size, stat.st_mtime_ns
+
+    def fingerprint(self):
+        """Return absolute path, size and modification time of the file.
+
+        Unlike the hash, this does not look at the contents, it only
+        tells if the file may have changed."""
+        stat = os.stat(self.file)
+        return os.path.abspath(self.file), stat.st_size, stat.st_mtime_ns
+
     def hash(self):
-        checksums = array.array('L')
-        for zo in self.zip.infolist():
-            checksums.append(zo.CRC)
-        h = blake2b()
-        h.update(checksums)
-        return h.hexdigest()
+        """Return a checksum over the CRCs of all members, computed once."""
+        if self._hash is None:
+            from hashlib import blake2b
+            checksums = array.array('L')
+            for zo in self.zip.infolist():
+                checksums.append(zo.CRC)
+            h = blake2b()
+            h.update(checksums)
+            self._hash = h.hexdigest()
+        return self._hash
 
-    @property
-    @functools.lru_cache()
+    @functools.cached_property
     def bodymatter(self):
         if self.nav_doc is not None:
             return self.nav_doc.bodymatter
@@ -66,8 +183,7 @@ class Epub:
                 if href:
                     return urlparse(href, self.rootfile)
 
-    @property
-    @functools.lru_cache()
+    @functools.cached_property
     def ncx_file(self):
         spine = self.root.find('.//opf:spine', self.NS)
         item = None
@@ -85,16 +201,21 @@ class Epub:
             if file:
                 return urlparse(file, self.rootfile).path
 
-    @property
-    @functools.lru_cache()
-    def mimetype(self,file):
-        item = self.root.find(
-            f'.//opf:manifest/opf:item[@href="{file}"]', self.NS)
-        if item is not None:
-            return item.get('media-type')
+    @functools.cached_property
+    def media_types(self):
+        types = {}
+        for item in self.root.findall('.//opf:manifest/opf:item', self.NS):
+            href = item.get('href')
+            if href:
+                file = urlparse(href, self.rootfile).path
+                types[file] = item.get('media-type')
+        return types
 
-    @property
-    @functools.lru_cache()
+    def mimetype(self, file):
+        """Return the media type the manifest declares for member file."""
+        return self.media_types.get(file)
+
+    @functools.cached_property
     def toc(self):
         source = None
         base_url = None
@@ -111,10 +232,10 @@ class Epub:
                 if href:
                     url = urlparse(href, self.rootfile)
                     base_url = url.path
-                    source = ET.parse(self.zip.open(url.path)).getroot()
-        if source is None:
+                    source = ET.fromstring(self.read(url.path))
+        if source is None and self.ncx_file:
             html = ''
-            tree = ET.parse(self.zip.open(self.ncx_file))
+            tree = ET.fromstring(self.read(self.ncx_file))
             navmap = tree.find('.//daisy:navMap', self.NS)
             html = self.navmap_to_html(navmap)
             if html:
@@ -146,18 +267,16 @@ class Epub:
             html += '</li></ol>'
         return html
 
-    @property
-    @functools.lru_cache()
+    @functools.cached_property
     def nav_doc(self):
         item = self.root.find(
             './/opf:manifest/opf:item[@properties="nav"]', self.NS)
         if item is not None:
             href = item.get('href')
             if href:
-                return NavDoc(self.zip, urlparse(href, self.rootfile).path)
+                return NavDoc(self, urlparse(href, self.rootfile).path)
 
-    @property
-    @functools.lru_cache()
+    @functools.cached_property
     def chapters(self):
         manifest = {}
         for i in self.root.findall('opf:manifest/opf:item', self.NS):
@@ -170,32 +289,124 @@ class Epub:
                 href = item.get('href')
                 if href:
                     file = urlparse(href, self.rootfile).path
-                    ## TODO check meta/charset for encoding
-                    source = self.zip.open(file).read().decode("utf8")
-                    chapters.append(Chapter(source, file))
+                    chapters.append(Chapter(self, file))
         return chapters
 
+    def read_chapter(self, file):
+        ## TODO check meta/charset for encoding
+        ## The decoded source is kept by the chapter or the source cache,
+        ## the bytes are not needed anymore.
+        return self.read(file, cache=False).decode("utf8")
+
 class Chapter():
-    def __init__(self, source, file):
-        self.source = source
+    def __init__(self, epub, file):
+        self.epub = epub
         self.file = file
+        self._source = None
+
+    @property
+    def source(self):
+        if self._source is not None:
+            return self._source
+
+        cache = self.epub.source_cache
+        if cache is None:
+            self._source = self.epub.read_chapter(self.file)
+            return self._source
+
+        source = cache.get(self.file)
+        if source is None:
+            source = self.epub.read_chapter(self.file)
+            cache.put(self.file, source)
+        return source
+
+class SourceCache():
+    def __init__(self, size):
+        self.size = size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            value = self.entries.get(key)
+            if value is not None:
+                self.entries.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+def map_file(file):
+    """Return the open file and its mapping into memory, or None if it
+    can not be mapped or may be written to."""
+    try:
+        fh = open(file, 'rb')
+    except OSError:
+        return None
+    ## Touching the mapping of a truncated file raises SIGBUS, which can't
+    ## be caught. Only files on read-only file systems or without any write
+    ## permission are mapped, other books go through zipfile.
+    stat = os.fstat(fh.fileno())
+    if (stat.st_mode & 0o222
+            and not os.fstatvfs(fh.fileno()).f_flag & os.ST_RDONLY):
+        fh.close()
+        return None
+    try:
+        return fh, mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+    except (ValueError, OSError):
+        ## empty files, pipes and the like; opening the zip file reports
+        ## what is wrong with them
+        fh.close()
+        return None
+
+class MemberCache():
+    """Contents of zip members, least recently used first, limited to
+    budget bytes in total. Members larger than budget are not kept."""
+
+    def __init__(self, budget):
+        self.budget = budget
+        self.size = 0
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, name):
+        with self.lock:
+            data = self.entries.get(name)
+            if data is not None:
+                self.entries.move_to_end(name)
+            return data
+
+    def put(self, name, data):
+        if len(data) > self.budget:
+            return
+        with self.lock:
+            old = self.entries.pop(name, None)
+            if old is not None:
+                self.size -= len(old)
+            self.entries[name] = data
+            self.size += len(data)
+            while self.size > self.budget:
+                _, old = self.entries.popitem(last=False)
+                self.size -= len(old)
 
 class NavDoc:
     NS = {
         "epub": "http://www.idpf.org/2007/ops",
         "xhtml": "http://www.w3.org/1999/xhtml",
     }
-    def __init__(self, zip, file):
+    def __init__(self, epub, file):
         self.file = file
-        self.dom = ET.parse(zip.open(file))
+        self.dom = ET.fromstring(epub.read(file))
 
-    @property
-    @functools.lru_cache()
+    @functools.cached_property
     def toc(self):
         return self.dom.find('.//xhtml:nav[@epub:type="toc"]', self.NS)
 
-    @property
-    @functools.lru_cache()
+    @functools.cached_property
     def bodymatter(self):
         link = self.dom.find('.//xhtml:a[@epub:type="bodymatter"]', self.NS)
         if link is not None:
@@ -203,8 +414,7 @@ class NavDoc:
             if href:
                 return urlparse(href, self.file)
 
-    @property
-    @functools.lru_cache()
+    @functools.cached_property
     def page_list(self):
         pages = {}
         nav = self.dom.find('.//xhtml:nav[@epub:type="page-list"]', self.NS)
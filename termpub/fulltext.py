@@ -0,0 +1,256 @@
+import argparse
+import os
+import sqlite3
+import sys
+
+from termpub.renderer import Renderer
+
+class FulltextIndex():
+    """Rendered text of whole books in an sqlite FTS5 table.
+
+    Every non-empty line is stored with its chapter, line number and
+    character position, the position being counted like
+    Reader.get_position, so hits can be opened in the reader. Books are
+    keyed by their hash and only indexed again if the hash, the width or
+    the renderer version changed. The lines of a book get consecutive
+    rowids, stored with the book, so they are deleted by rowid instead of
+    scanning the whole index."""
+
+    def __init__(self, file):
+        self.file = file
+        self.con = sqlite3.connect(file)
+        self.con.execute('PRAGMA journal_mode = WAL')
+        with self.con:
+            self.con.execute("""
+                CREATE TABLE IF NOT EXISTS books (
+                    hash      TEXT NOT NULL PRIMARY KEY,
+                    path      TEXT NOT NULL,
+                    width     INTEGER NOT NULL,
+                    version   INTEGER NOT NULL,
+                    first     INTEGER,
+                    last      INTEGER
+                )
+            """)
+            self.con.execute(
+                'CREATE INDEX IF NOT EXISTS books_path ON books (path)')
+            self.con.execute("""
+                CREATE VIRTUAL TABLE IF NOT EXISTS lines USING fts5 (
+                    text,
+                    hash UNINDEXED,
+                    chapter UNINDEXED,
+                    line UNINDEXED,
+                    position UNINDEXED
+                )
+            """)
+
+    def indexed(self, hash, width):
+        """Return True if the book is indexed at width."""
+        row = self.con.execute(
+            'SELECT width, version FROM books WHERE hash = ?',
+            (hash,)).fetchone()
+        return row == (width, Renderer.version)
+
+    def move(self, hash, path):
+        with self.con:
+            self.con.execute(
+                'UPDATE books SET path = ? WHERE hash = ?', (path, hash))
+
+    def put(self, hash, path, width, lines):
+        """Replace the lines of a book and forget books previously found at
+        path. lines are (text, chapter, line, position) tuples."""
+        with self.con:
+            stale = [row[0] for row in self.con.execute(
+                'SELECT hash FROM books WHERE path = ? OR hash = ?',
+                (path, hash))]
+            self.delete(stale)
+            first = last = None
+            if lines:
+                ## rowids are assigned here, FTS5 does not promise
+                ## consecutive ones to the rows of one executemany
+                row = self.con.execute(
+                    'SELECT rowid FROM lines ORDER BY rowid DESC LIMIT 1'
+                    ).fetchone()
+                first = (row[0] if row else 0) + 1
+                last = first + len(lines) - 1
+                self.con.executemany(
+                    'INSERT INTO lines (rowid, text, hash, chapter, line, '
+                    'position) VALUES (?,?,?,?,?,?)',
+                    ((rowid, text, hash, chapter, line, position)
+                        for rowid, (text, chapter, line, position)
+                        in enumerate(lines, first)))
+            self.con.execute('INSERT INTO books VALUES (?,?,?,?,?,?)',
+                (hash, path, width, Renderer.version, first, last))
+
+    def delete(self, hashes):
+        for hash in hashes:
+            row = self.con.execute(
+                'SELECT first, last FROM books WHERE hash = ?',
+                (hash,)).fetchone()
+            if row is None:
+                continue
+            self.con.execute('DELETE FROM books WHERE hash = ?', (hash,))
+            if row[0] is not None:
+                self.con.execute(
+                    'DELETE FROM lines WHERE rowid BETWEEN ? AND ?', row)
+
+    def prune(self):
+        """Forget books whose file does not exist anymore."""
+        paths = self.con.execute('SELECT hash, path FROM books').fetchall()
+        with self.con:
+            self.delete(x for x, path in paths if not os.path.exists(path))
+
+    def search(self, query, limit=50):
+        """Return (path, chapter, line, position, text) of the best
+        matching lines. query uses the FTS5 query syntax."""
+        return self.con.execute("""
+            SELECT books.path, lines.chapter, lines.line, lines.position,
+                lines.text
+            FROM lines JOIN books ON books.hash = lines.hash
+            WHERE lines MATCH ?
+            ORDER BY rank LIMIT ?
+        """, (query, limit)).fetchall()
+
+    def close(self):
+        self.con.close()
+
+def index_book(path, width):
+    """Return (path, hash, lines) of a rendered book, lines as expected
+    by FulltextIndex.put. This runs in the index workers."""
+    from termpub import dump
+    import termpub.width
+
+    try:
+        dump.init_worker(path, width, None)
+        epub = dump.worker['epub']
+        lines = []
+        for index, chapter in enumerate(epub.chapters):
+            position = 0
+            for number, text in enumerate(dump.render_chapter(index)):
+                if text.strip():
+                    lines.append((text, chapter.file, number, position + 1))
+                position += termpub.width.length(text)
+        return path, epub.hash(), lines, None
+    except Exception as e:
+        return path, None, None, str(e) or e.__class__.__name__
+
+def book_hashes(paths, catalog_file):
+    """Return a dict of the epubs at paths to their hash, or to None if
+    the hash has to be computed. Unchanged books take their hash from the
+    library catalog."""
+    from termpub.library import Catalog, find_epubs
+
+    known = {}
+    if os.path.isfile(catalog_file):
+        catalog = Catalog(catalog_file)
+        known = {x['path']: x for x in catalog.books()}
+        catalog.close()
+        if not paths:
+            paths = list(known)
+
+    hashes = {}
+    for path in find_epubs(paths):
+        book = known.get(path)
+        hashes[path] = None
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        if book and (book['size'], book['mtime']) == \
+                (stat.st_size, stat.st_mtime_ns):
+            hashes[path] = book['hash']
+    return hashes
+
+def update(index, paths, catalog_file, width=80, jobs=1):
+    """Index the books at paths, or all books in the library catalog if
+    paths is empty. Return the number of indexed and failed books."""
+
+    hashes = book_hashes(paths, catalog_file)
+    todo = []
+    for path, hash in hashes.items():
+        if hash is None:
+            from termpub.epub import Epub
+            try:
+                hash = Epub(path).hash()
+            except Exception as e:
+                print(f'termpub: {path}: {e}', file=sys.stderr)
+                continue
+        if index.indexed(hash, width):
+            index.move(hash, path)
+        else:
+            todo.append(path)
+    index.prune()
+
+    if jobs == 0:
+        jobs = os.cpu_count() or 1
+    if jobs <= 1 or len(todo) <= 1:
+        results = (index_book(x, width) for x in todo)
+        executor = None
+    else:
+        from concurrent.futures import ProcessPoolExecutor
+        executor = ProcessPoolExecutor(max_workers=jobs)
+        results = executor.map(index_book, todo, [width] * len(todo))
+
+    failed = 0
+    try:
+        for path, hash, lines, error in results:
+            if error:
+                failed += 1
+                print(f'termpub: {path}: {error}', file=sys.stderr)
+            else:
+                index.put(hash, path, width, lines)
+    finally:
+        if executor:
+            executor.shutdown()
+    return len(todo) - failed, failed
+
+def main(argv, index_file, catalog_file):
+    """Run termpub search with argv. Return the exit status, or a
+    (path, chapter, position) hit if it should be opened."""
+    parser = argparse.ArgumentParser(prog='termpub search',
+        description='Search the text of all books in the library')
+    commands = parser.add_subparsers(dest='command', metavar='COMMAND')
+    commands.required = True
+
+    index_parser = commands.add_parser('index',
+        help='index books, all books in the library by default')
+    index_parser.add_argument('paths', metavar='PATH', nargs='*',
+        help='directory or epub to index')
+    index_parser.add_argument('--jobs', type=int, metavar='N', default=0,
+        help='render books in N processes, 0 for all cpus')
+    index_parser.add_argument('--width', type=int, default=80,
+        help='render books at this width')
+
+    query_parser = commands.add_parser('query', help='search indexed books')
+    query_parser.add_argument('query', metavar='QUERY', nargs='+',
+        help='words to search, in sqlite FTS5 query syntax')
+    query_parser.add_argument('--limit', type=int, default=50,
+        help='print at most this many hits')
+    query_parser.add_argument('--open', type=int, metavar='N',
+        help='open hit N in the reader')
+
+    args = parser.parse_args(argv)
+    index = FulltextIndex(index_file)
+    try:
+        if args.command == 'index':
+            indexed, failed = update(
+                index, args.paths, catalog_file, args.width, args.jobs)
+            print(f'{indexed} indexed, {failed} failed', file=sys.stderr)
+            return 0
+
+        try:
+            hits = index.search(' '.join(args.query), args.limit)
+        except sqlite3.OperationalError as e:
+            print(f'termpub: invalid query: {e}', file=sys.stderr)
+            return 2
+        if args.open is not None:
+            if not 0 < args.open <= len(hits):
+                print(f'termpub: no hit {args.open}', file=sys.stderr)
+                return 1
+            path, chapter, line, position, text = hits[args.open - 1]
+            return path, chapter, position
+        for number, (path, chapter, line, position, text) in \
+                enumerate(hits, 1):
+            print(f'{number}\t{path}\t{chapter}:{position}\t{text.strip()}')
+        return 0 if hits else 1
+    finally:
+        index.close()
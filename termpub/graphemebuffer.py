@@ -20,7 +20,7 @@ class Buffer():
 
     def replace(self, start, end, chunk):
         self.graphemes[start:end] = chunk
-        self.index = start + width.width(chunk)
+        self.index = start + width.length(chunk)
 
     def move_to_start(self):
         self.index = 0
@@ -0,0 +1,131 @@
+from collections import OrderedDict
+import importlib.metadata
+import importlib.util
+import json
+import sqlite3
+import threading
+
+import termpub.width as width
+
+def pyphen_available():
+    """Return True if pyphen is installed, without importing it."""
+    return importlib.util.find_spec('pyphen') is not None
+
+def pyphen_version():
+    """Return the installed pyphen version without importing it, or None
+    if pyphen is not installed."""
+    try:
+        return importlib.metadata.version('pyphen')
+    except importlib.metadata.PackageNotFoundError:
+        return None
+
+class Hyphenator():
+    """Hyphenation points of words for one language.
+
+    The pyphen dictionary is loaded when the first word has to be split.
+    The ways to split a word are kept in a bounded LRU, and if file is
+    set, in a sqlite database shared by all books of that language. Rows
+    are kept per pyphen version, so updated patterns are picked up. A
+    hyphenator can be shared between threads."""
+
+    def __init__(self, language, file=None, cache_size=4096):
+        self.language = language
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+        self.dic = None
+        self.loaded = False
+        self.pending = []
+        self.con = None
+        self.version = None
+        if file:
+            self.version = pyphen_version()
+            self.con = sqlite3.connect(file, check_same_thread=False)
+            with self.con:
+                self.con.execute("""
+                    CREATE TABLE IF NOT EXISTS words (
+                        language  TEXT NOT NULL,
+                        version   TEXT NOT NULL,
+                        word      TEXT NOT NULL,
+                        pairs     TEXT NOT NULL,
+                        PRIMARY KEY (language, version, word)
+                    )
+                """)
+
+    def dictionary(self):
+        with self.lock:
+            if not self.loaded:
+                self.loaded = True
+                try:
+                    import pyphen
+                    self.dic = pyphen.Pyphen(lang=self.language)
+                except (ModuleNotFoundError, KeyError):
+                    self.dic = None
+        return self.dic
+
+    def pairs(self, word):
+        """Return all ways to split word as (start, end) tuples, the
+        longest start first."""
+        with self.lock:
+            pairs = self.cache.get(word)
+            if pairs is not None:
+                self.cache.move_to_end(word)
+                return pairs
+
+        ## The lock only guards the LRU and the queued rows, so the
+        ## prefetch thread doesn't wait for the UI splitting other words.
+        store = False
+        pairs = self.lookup(word)
+        if pairs is None:
+            dic = self.dictionary()
+            ## without a dictionary nothing is stored, a later run may
+            ## have one
+            pairs = tuple(dic.iterate(word)) if dic else ()
+            store = dic is not None
+
+        with self.lock:
+            if store and self.con and self.version:
+                self.pending.append(
+                    (self.language, self.version, word, json.dumps(pairs)))
+                if len(self.pending) >= 256:
+                    self.flush()
+
+            self.cache[word] = pairs
+            if len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+            return pairs
+
+    def split(self, word, space):
+        """Return the longest (start, end) split of word whose start fits
+        into space columns together with a hyphen, or None."""
+        for pair in self.pairs(word):
+            if width.width(pair[0]) + 1 <= space:
+                return pair
+        return None
+
+    def lookup(self, word):
+        con = self.con
+        if not con or not self.version:
+            return None
+        row = con.execute(
+            'SELECT pairs FROM words '
+            'WHERE language = ? AND version = ? AND word = ?',
+            (self.language, self.version, word)).fetchone()
+        if row is None:
+            return None
+        return tuple(tuple(x) for x in json.loads(row[0]))
+
+    def flush(self):
+        if self.pending:
+            with self.con:
+                self.con.executemany(
+                    'INSERT OR REPLACE INTO words VALUES (?,?,?,?)',
+                    self.pending)
+            self.pending = []
+
+    def close(self):
+        with self.lock:
+            if self.con:
+                self.flush()
+                self.con.close()
+                self.con = None
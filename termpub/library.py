@@ -0,0 +1,246 @@
+import argparse
+import json
+import os
+import sqlite3
+import sys
+
+class Catalog():
+    """Metadata of all books found by library scans.
+
+    Every book is stored with the size and modification time of its file,
+    so a rescan only has to read books that changed. Listing and
+    filtering only query the database, they never open an epub."""
+
+    def __init__(self, file):
+        self.file = file
+        self.con = sqlite3.connect(file)
+        self.con.execute('PRAGMA journal_mode = WAL')
+        with self.con:
+            self.con.execute("""
+                CREATE TABLE IF NOT EXISTS books (
+                    path      TEXT NOT NULL PRIMARY KEY,
+                    size      INTEGER NOT NULL,
+                    mtime     INTEGER NOT NULL,
+                    hash      TEXT,
+                    title     TEXT,
+                    author    TEXT,
+                    language  TEXT,
+                    chapters  INTEGER,
+                    toc       TEXT,
+                    error     TEXT
+                )
+            """)
+            self.con.execute(
+                'CREATE INDEX IF NOT EXISTS books_author ON books '
+                '(author COLLATE NOCASE, title COLLATE NOCASE)')
+            self.con.execute(
+                'CREATE INDEX IF NOT EXISTS books_title ON books '
+                '(title COLLATE NOCASE)')
+            self.con.execute(
+                'CREATE INDEX IF NOT EXISTS books_hash ON books (hash)')
+
+    def files(self):
+        """Return a dict of all known paths to (size, mtime)."""
+        cur = self.con.execute('SELECT path, size, mtime FROM books')
+        return {path: (size, mtime) for path, size, mtime in cur}
+
+    def put(self, rows):
+        """Store (path, size, mtime, metadata, error) rows, metadata being
+        a dict returned by read_metadata or None."""
+        with self.con:
+            for path, size, mtime, metadata, error in rows:
+                metadata = metadata or {}
+                self.con.execute('INSERT OR REPLACE INTO books '
+                    'VALUES (?,?,?,?,?,?,?,?,?,?)',
+                    (path, size, mtime, metadata.get('hash'),
+                        metadata.get('title'), metadata.get('author'),
+                        metadata.get('language'), metadata.get('chapters'),
+                        json.dumps(metadata.get('toc', [])), error))
+
+    def remove(self, paths):
+        with self.con:
+            self.con.executemany(
+                'DELETE FROM books WHERE path = ?', ((x,) for x in paths))
+
+    def books(self, text=None, title=None, author=None, language=None):
+        """Return the rows of all readable books matching the filters,
+        ordered by author and title. text matches title or author."""
+        where = ['error IS NULL']
+        args = []
+        if text:
+            where.append('(title LIKE ? OR author LIKE ?)')
+            args += [f'%{text}%', f'%{text}%']
+        if title:
+            where.append('title LIKE ?')
+            args.append(f'%{title}%')
+        if author:
+            where.append('author LIKE ?')
+            args.append(f'%{author}%')
+        if language:
+            where.append('language LIKE ?')
+            args.append(f'{language}%')
+        self.con.row_factory = sqlite3.Row
+        try:
+            return self.con.execute(f"""
+                SELECT * FROM books WHERE {' AND '.join(where)}
+                ORDER BY author COLLATE NOCASE, title COLLATE NOCASE
+            """, args).fetchall()
+        finally:
+            self.con.row_factory = None
+
+    def book(self, path):
+        self.con.row_factory = sqlite3.Row
+        try:
+            return self.con.execute(
+                'SELECT * FROM books WHERE path = ?', (path,)).fetchone()
+        finally:
+            self.con.row_factory = None
+
+    def close(self):
+        self.con.close()
+
+def find_epubs(paths):
+    """Yield the absolute paths of all epubs in or at paths."""
+    for path in paths:
+        path = os.path.abspath(path)
+        if os.path.isfile(path):
+            yield path
+            continue
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for file in sorted(files):
+                if file.lower().endswith('.epub'):
+                    yield os.path.join(root, file)
+
+def toc_entries(toc):
+    """Return [label, href] of all links in a table of contents."""
+    import xml.etree.ElementTree as ET
+    entries = []
+    for element in ET.fromstring(toc).iter():
+        if element.tag.endswith('}a') or element.tag == 'a':
+            href = element.get('href')
+            if href:
+                label = ' '.join(''.join(element.itertext()).split())
+                entries.append([label, href])
+    return entries
+
+def read_metadata(path):
+    """Return (path, metadata, error) of the epub at path. This runs in
+    the scan workers."""
+    from termpub.epub import Epub
+    try:
+        epub = Epub(path)
+        toc = epub.toc
+        return path, {
+            'hash': epub.hash(),
+            'title': epub.title,
+            'author': epub.author,
+            'language': epub.language,
+            'chapters': len(epub.chapters),
+            'toc': toc_entries(toc) if toc else [],
+        }, None
+    except Exception as e:
+        return path, None, str(e) or e.__class__.__name__
+
+def scan(catalog, paths, jobs=1):
+    """Bring the catalog up to date with the epubs in paths.
+
+    Only new books and books whose size or modification time changed
+    are read, in jobs worker processes. Books that disappeared from
+    paths are removed. Return the number of read, removed and failed
+    books."""
+
+    known = catalog.files()
+    found = {}
+    for path in find_epubs(paths):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        found[path] = (stat.st_size, stat.st_mtime_ns)
+
+    roots = [os.path.abspath(x) for x in paths]
+    def scanned(path):
+        return any(path == x or path.startswith(x.rstrip(os.sep) + os.sep)
+            for x in roots)
+    removed = [x for x in known if x not in found and scanned(x)]
+    catalog.remove(removed)
+
+    changed = [x for x, stat in found.items() if known.get(x) != stat]
+    if jobs == 0:
+        jobs = os.cpu_count() or 1
+
+    if jobs <= 1 or len(changed) <= 1:
+        results = map(read_metadata, changed)
+        executor = None
+    else:
+        from concurrent.futures import ProcessPoolExecutor
+        executor = ProcessPoolExecutor(max_workers=jobs)
+        results = executor.map(read_metadata, changed, chunksize=16)
+
+    failed = 0
+    rows = []
+    try:
+        for path, metadata, error in results:
+            if error:
+                failed += 1
+                print(f'termpub: {path}: {error}', file=sys.stderr)
+            rows.append((path, *found[path], metadata, error))
+            ## commit in batches, so an interrupted scan keeps its work
+            if len(rows) >= 256:
+                catalog.put(rows)
+                rows = []
+        catalog.put(rows)
+    finally:
+        if executor:
+            executor.shutdown()
+    return len(changed), len(removed), failed
+
+def main(argv, catalog_file):
+    parser = argparse.ArgumentParser(
+        prog='termpub library', description='Manage a catalog of epubs')
+    commands = parser.add_subparsers(dest='command', metavar='COMMAND')
+    commands.required = True
+
+    scan_parser = commands.add_parser('scan',
+        help='add epubs in directories to the catalog')
+    scan_parser.add_argument('paths', metavar='PATH', nargs='+',
+        help='directory or epub to scan')
+    scan_parser.add_argument('--jobs', type=int, metavar='N', default=0,
+        help='read books in N processes, 0 for all cpus')
+
+    list_parser = commands.add_parser('list', help='list books')
+    list_parser.add_argument('text', metavar='TEXT', nargs='?',
+        help='only list books with TEXT in title or author')
+    list_parser.add_argument('--title', help='filter by title')
+    list_parser.add_argument('--author', help='filter by author')
+    list_parser.add_argument('--language', help='filter by language')
+
+    toc_parser = commands.add_parser('toc',
+        help='print the table of contents of a book')
+    toc_parser.add_argument('path', metavar='FILE')
+
+    args = parser.parse_args(argv)
+    catalog = Catalog(catalog_file)
+    try:
+        if args.command == 'scan':
+            read, removed, failed = scan(catalog, args.paths, args.jobs)
+            print(f'{read} read, {removed} removed, {failed} failed',
+                file=sys.stderr)
+        elif args.command == 'list':
+            for book in catalog.books(
+                    args.text, args.title, args.author, args.language):
+                print('\t'.join([book['author'] or '', book['title'] or '',
+                    book['language'] or '', str(book['chapters']),
+                    book['path']]))
+        elif args.command == 'toc':
+            book = catalog.book(os.path.abspath(args.path))
+            if book is None:
+                print(f'termpub: {args.path} is not in the library',
+                    file=sys.stderr)
+                return 1
+            for label, href in json.loads(book['toc']):
+                print(f'{label}\t{href}')
+    finally:
+        catalog.close()
+    return 0
@@ -1,15 +1,28 @@
+from array import array
+from bisect import bisect_left, bisect_right
 import curses
 import curses.ascii
 import re
-from termpub.width import width
+from termpub.width import width, cut
 from termpub.readline import readline, ResizeEvent, HistoryBuffer
 from termpub.renderer import Renderer
 from termpub.commands import parse_command, CommandException
 from termpub.exec import exec_wait
 from termpub.graphemebuffer import Buffer
+from termpub.search import Matcher
 
 class Pager():
 
+    ## Draw only the visible lines straight to the screen instead of
+    ## keeping the whole document on a curses pad.
+    windowed = True
+
+    ## Patterns without uppercase letters ignore case.
+    smartcase = False
+
+    ## Search for plain text instead of regular expressions.
+    literal = False
+
     def __init__(self,stdscr,title=''):
         self.max_y, self.max_x = stdscr.getmaxyx()
 
@@ -29,6 +42,7 @@ class Pager():
         self.horizontal_increment = int(self.max_x / 2)
 
         self.pattern = ''
+        self.matcher = None
         self.highlight = 0
         self.search_direction = 'forward'
 
@@ -38,6 +52,9 @@ class Pager():
 
         self.position = {}
 
+        self.pad = None
+        self.invalidate()
+
         self.command_history = HistoryBuffer()
         self.search_history = HistoryBuffer()
 
@@ -63,8 +80,15 @@ class Pager():
         if self.prefix:
             self.horizontal_increment = self.prefix
         self.x += self.horizontal_increment
+        if self.windowed:
+            ## only the visible lines are measured
+            self.max_line_length = 0
+            for line in self.lines[self.y:self.y + self.max_y]:
+                self.max_line_length = max(self.max_line_length, width(line))
         if self.max_x + self.x > self.max_line_length:
             self.x = self.max_line_length - self.max_x
+        if self.x < 0:
+            self.x = 0
 
     def set_width(self, width=None):
         if width:
@@ -91,21 +115,29 @@ class Pager():
     def update_status_data(self, data=None):
         if data is None:
             data = {}
+        line_count = self.line_count()
         last_line = self.y + self.max_y
-        if last_line > len(self.lines):
-            last_line = len(self.lines)
-        percent = int( last_line * 100 / len(self.lines))
+        if last_line > line_count:
+            last_line = line_count
+        percent = int( last_line * 100 / line_count)
         data['percent'] = str(percent) + '%'
         data['title_len'] = width(self.title)
         data['title'] = self.title
         return data
 
     def draw_status_line(self):
+        """Draw the status line if it changed.
+           Returns True if something was drawn."""
         data = self.update_status_data()
 
         status_left = self.status_left.format(**data, remaining=0)
         status_right = self.status_right.format(**data, remaining=0)
 
+        status = (status_left, status_right, self.max_x, self.max_y)
+        if status == self.drawn_status:
+            return False
+        self.drawn_status = status
+
         width_status_left = width(status_left)
         width_status_right = width(status_right)
 
@@ -114,53 +146,137 @@ class Pager():
         self.stdscr.addstr(
             self.max_y, self.max_x - width_status_right, status_right)
         self.stdscr.chgat( self.max_y, 0, -1, curses.A_STANDOUT );
+        return True
+
+    def draw_message(self):
+        """Show the pending message, or clear the message line if there is
+           none. Returns True if something was drawn."""
+        message = self.message
+        self.message = ''
+        if message:
+            buffer = Buffer(message)
+            buffer.graphemes = buffer.graphemes[0:self.max_x-1]
+            message = buffer.to_string()
+
+        if message == self.drawn_message:
+            return False
+        self.drawn_message = message
+
+        if message:
+            self.stdscr.addstr(self.max_y + 1, 0, message)
+        else:
+            self.stdscr.move(self.max_y + 1, 0)
+        self.stdscr.clrtoeol()
+        return True
+
+    def view_state(self):
+        """Everything the visible part of the text depends on."""
+        return (
+            id(self.lines),
+            min(len(self.lines), self.y + self.max_y),
+            self.y,
+            self.x,
+            self.max_x,
+            self.max_y,
+            self.pattern,
+            self.highlight,
+            id(self.pad),
+        )
+
+    def draw_view(self):
+        """Draw the visible lines if they changed.
+           Returns True if something was drawn."""
+        view = self.view_state()
+        if view == self.drawn_view:
+            return False
+
+        old_view = self.drawn_view
+        self.drawn_view = view
+
+        ## the pad is copied to the screen by refresh_pad()
+        if not self.windowed:
+            return True
+
+        ## If only y moved by less than a screen, scroll the text area and
+        ## draw just the uncovered lines.
+        lines = range(self.max_y)
+        if (old_view is not None and old_view[0] == view[0]
+                and old_view[3:] == view[3:]):
+            distance = self.y - old_view[2]
+            if 0 < abs(distance) < self.max_y:
+                self.stdscr.scrollok(True)
+                self.stdscr.setscrreg(0, self.max_y - 1)
+                self.stdscr.scroll(distance)
+                self.stdscr.setscrreg(0, self.max_y + 1)
+                self.stdscr.scrollok(False)
+                if distance > 0:
+                    lines = set(range(self.max_y - distance, self.max_y))
+                else:
+                    lines = set(range(-distance))
+                ## lines rendered since the last draw show up below the old
+                ## end of the text
+                lines.update(range(max(old_view[1] - self.y, 0),
+                    view[1] - self.y))
+
+        for row in lines:
+            self.draw_line(row)
+        return True
+
+    def refresh_pad(self):
+        self.pad.noutrefresh(self.y,self.x,0,0,self.max_y-1,self.max_x-1)
+        remaining_lines = len(self.lines) - self.y
+        if remaining_lines < self.max_y:
+            win = curses.newwin(
+                self.max_y - remaining_lines,
+                self.max_x,
+                len(self.lines) - self.y,
+                0
+            )
+            win.erase()
+            win.noutrefresh()
+
+    def invalidate(self):
+        """Draw everything again on the next update."""
+        self.drawn_view = None
+        self.drawn_status = None
+        self.drawn_message = None
 
     def redraw(self):
         """Redraw screen"""
         self.stdscr.clear()
+        self.invalidate()
 
     def update(self):
 
         self.render_pad()
 
         self.stdscr.keypad(True)
+        self.stdscr.idlok(True)
 
-        redraw = 1
+        self.invalidate()
 
-        ## TODO redraw only if something like y or the pad changed
         while True:
 
-            self.draw_status_line()
+            ## render one screen ahead, so the next page is ready
+            self.require_lines(self.y + 2 * self.max_y)
 
-            if self.message:
-                buffer = Buffer(self.message)
-                buffer.graphemes = buffer.graphemes[0:self.max_x-1] 
-                self.stdscr.addstr(self.max_y + 1, 0, buffer.to_string())
-                self.message = ''
-            else:
-                self.stdscr.move(self.max_y + 1, 0)
-            self.stdscr.clrtoeol()
-
-            if redraw:
-                self.stdscr.refresh()
-                self.pad.refresh(self.y,self.x,0,0,self.max_y-1,self.max_x-1)
-                remaining_lines = len(self.lines) - self.y
-                if remaining_lines < self.max_y:
-                    win = curses.newwin(
-                        self.max_y - remaining_lines,
-                        self.max_x,
-                        len(self.lines) - self.y,
-                        0
-                    )
-                    win.clear()
-                    win.refresh()
-                redraw=1
+            ## Something else, like another pager, drew over the screen.
+            if self.stdscr.is_wintouched():
+                self.invalidate()
+
+            view_changed = self.draw_view()
+            changed = self.draw_status_line() or view_changed
+            changed = self.draw_message() or changed
+            if changed:
+                self.stdscr.noutrefresh()
+                if view_changed and not self.windowed:
+                    self.refresh_pad()
+                curses.doupdate()
 
             key = self.getkey()
 
             if re.match(r'^\d$', key):
                 self.prefix += key
-                redraw=0
                 continue
             if key in self.keys:
                 if self.prefix:
@@ -171,10 +287,10 @@ class Pager():
                 if method_name in self.exit_functions:
                     self.stdscr.erase()
                     return rc
+                self.command_done()
             else:
                 self.show_error(f"Key {key} is not bound.  Press 'h' for help.")
             self.prefix = ''
-            redraw=1
 
     key_translations = {
         '\n': 'RETURN',
@@ -202,13 +318,13 @@ class Pager():
                     return self.key_translations[c]
                 if type(c) is str:
                     if c == '\x1b':
-                        self.pad.nodelay(True)
-                        n = self.pad.getch()
+                        self.stdscr.nodelay(True)
+                        n = self.stdscr.getch()
+                        self.stdscr.nodelay(False)
                         if n == -1:
                             return 'ESC'
                         else:
                             return 'ESC-' + curses.keyname(n).decode()
-                        self.pad.nodelay(False)
                     elif curses.ascii.iscntrl(c):
                         keyname = curses.ascii.unctrl(c)
                         if keyname.startswith('^'):
@@ -222,13 +338,29 @@ class Pager():
             except curses.error:
                 continue
 
-    def save_movement_marker(self):
+    def save_movement_marker(self, history=True):
         pass
 
+    def command_done(self):
+        """Called after every command that did not exit the pager."""
+        pass
+
+    def require_lines(self, count=None):
+        """Make sure that at least count lines, or all lines if count is
+        None, are available in self.lines and on the pad. Subclasses
+        that render their lines on demand override this."""
+        pass
+
+    def line_count(self):
+        """Number of lines of the document. This may be an estimate while
+        the document is not completely rendered."""
+        return len(self.lines)
+
     def next_line(self, n=1):
         """Scroll forward N lines, default 1."""
         if self.prefix:
             n = self.prefix
+        self.require_lines(self.y + n + 1)
         if self.y + n  < len(self.lines):
             self.y += n
 
@@ -243,8 +375,9 @@ class Pager():
         """ Display next page.
         Returns True if there's a next page."""
 
+        self.require_lines(self.y + self.max_y + 1)
         if self.y + self.max_y  < len(self.lines):
-            self.save_movement_marker()
+            self.save_movement_marker(history=False)
             self.y += self.max_y
             return True
         return False
@@ -254,7 +387,7 @@ class Pager():
         Returns True if there's a previous page."""
         if self.y == 0:
             return False
-        self.save_movement_marker()
+        self.save_movement_marker(history=False)
         self.y -= self.max_y
         if self.y < 0:
             self.y = 0
@@ -262,6 +395,7 @@ class Pager():
 
     def goto_end(self):
         """Go to line N in the file, default to the end of the chapter"""
+        self.require_lines()
         self.goto_line(len(self.lines) - self.max_y)
 
     def goto_line(self, default=0):
@@ -272,6 +406,7 @@ class Pager():
         else:
             self.y = default
 
+        self.require_lines(self.y + self.max_y)
         if self.y > len(self.lines):
             self.jump_to_last_page()
         if self.y < 0:
@@ -285,6 +420,7 @@ class Pager():
     def jump_to_last_page(self):
         """Go to the end of the chapter"""
         self.save_movement_marker()
+        self.require_lines()
         self.y = len(self.lines) - self.max_y
 
     def exit(self):
@@ -329,6 +465,7 @@ class Pager():
             curses.curs_set(1)
             line = readline(self.stdscr, prompt='Shell command: ')
             exec_wait(line, shell=True)
+            self.redraw()
         except ResizeEvent:
             self.resize()
         finally:
@@ -422,6 +559,11 @@ class Pager():
             curses.curs_set(0)
 
         if pattern:
+            try:
+                self.matcher = Matcher(pattern, self.smartcase, self.literal)
+            except re.error as e:
+                self.show_error(f'Invalid pattern: {e}')
+                return
             self.highlight = 1
             self.pattern = pattern
             self.render_pad()
@@ -431,25 +573,27 @@ class Pager():
     def goto_next_match(self):
         """Goto next lines with match.
            Returns True if a match is found, otherwise False."""
-        for line in self.matching_lines:
-            if line > self.y:
-                self.y = line
-                return True
+        self.require_lines()
+        index = bisect_right(self.matching_lines, self.y)
+        if index < len(self.matching_lines):
+            self.y = self.matching_lines[index]
+            return True
         return False
 
     def goto_prev_match(self):
         """Goto previous lines with match.
            Returns True if a match is found, otherwise False."""
-        for line in reversed(self.matching_lines):
-            if line < self.y:
-                self.y = line
-                return True
+        index = bisect_left(self.matching_lines, self.y)
+        if index > 0:
+            self.y = self.matching_lines[index - 1]
+            return True
         return False
 
     def goto_percent(self):
         """Go to a position N percent into the chapter"""
         self.save_movement_marker()
         if self.prefix:
+            self.require_lines()
             line_number = int(self.prefix * len(self.lines)/100)
             self.y = line_number
         else:
@@ -466,22 +610,93 @@ class Pager():
             self.lines = ['']
 
         self.max_line_length = 0
-        for line in self.lines:
-            w = width(line)
-            if w > self.max_line_length:
-                self.max_line_length = w
-
-        self.pad = curses.newpad(len(self.lines), self.max_line_length + 1)
-        for index,line in enumerate(self.lines):
-            self.pad.addstr(index,0,line)
-
-        self.matching_lines = []
-        if self.pattern and self.highlight:
-            for idx, line in enumerate(self.lines):
-                for m in re.finditer(self.pattern, line):
-                    self.matching_lines.append(idx)
-                    self.pad.chgat(
-                        idx, m.start(), m.end() - m.start(), curses.A_STANDOUT)
+        self.pad = None
+        self.seen_lines = 0
+        self.matching_lines = array('L')
+        self.match_spans = {}
+        self.add_lines()
+
+    def add_lines(self):
+        """Handle the lines appended to self.lines since the last call.
+        Unless in windowed mode, they are drawn to the pad, growing it as
+        needed."""
+        start = self.seen_lines
+        if start == len(self.lines) and (self.windowed or self.pad is not None):
+            return
+
+        if not self.windowed:
+            for line in self.lines[start:]:
+                w = width(line)
+                if w > self.max_line_length:
+                    self.max_line_length = w
+
+            if self.pad is None:
+                self.pad = curses.newpad(
+                    len(self.lines), self.max_line_length + 1)
+            else:
+                self.pad.resize(len(self.lines), self.max_line_length + 1)
+
+            for index in range(start, len(self.lines)):
+                self.pad.addstr(index, 0, self.lines[index])
+
+        ## Matching lines are kept sorted and only once. The offsets of the
+        ## matches are only looked up for lines that are drawn.
+        if self.matcher:
+            search = self.matcher.search
+            found = len(self.matching_lines)
+            self.matching_lines.extend(idx
+                for idx in range(start, len(self.lines))
+                if search(self.lines[idx]))
+            if not self.windowed and self.highlight:
+                for idx in self.matching_lines[found:]:
+                    self.highlight_pad_line(idx)
+
+        self.seen_lines = len(self.lines)
+
+    def match_offsets(self, idx):
+        """Return the start and end offsets of all matches in line idx as
+        flat array of pairs."""
+        offsets = self.match_spans.get(idx)
+        if offsets is None:
+            offsets = array('L')
+            for span in self.matcher.spans(self.lines[idx]):
+                offsets.extend(span)
+            self.match_spans[idx] = offsets
+        return offsets
+
+    def highlight_pad_line(self, idx):
+        line = self.lines[idx]
+        offsets = self.match_offsets(idx)
+        for i in range(0, len(offsets), 2):
+            start = width(line[:offsets[i]])
+            length = width(line[offsets[i]:offsets[i + 1]])
+            if length:
+                self.pad.chgat(idx, start, length, curses.A_STANDOUT)
+
+    def draw_line(self, row):
+        """Draw the line shown at row of the screen."""
+        self.stdscr.move(row, 0)
+        self.stdscr.clrtoeol()
+        idx = self.y + row
+        if idx >= len(self.lines):
+            return
+
+        line = self.lines[idx]
+        visible = cut(line, self.x, self.max_x)
+        if not visible:
+            return
+        self.stdscr.addstr(row, 0, visible)
+
+        if self.matcher and self.highlight:
+            offsets = self.match_offsets(idx)
+            for i in range(0, len(offsets), 2):
+                start = width(line[:offsets[i]]) - self.x
+                end = start + width(line[offsets[i]:offsets[i + 1]])
+                start = max(start, 0)
+                end = min(end, self.max_x)
+                if start < end:
+                    self.stdscr.chgat(
+                        row, start, end - start, curses.A_STANDOUT)
 
 class TextPager(Pager):
 
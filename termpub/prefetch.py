@@ -0,0 +1,48 @@
+from concurrent.futures import ThreadPoolExecutor, CancelledError
+import threading
+
+class Prefetcher():
+    """Runs render jobs on a background thread.
+
+    Jobs are identified by a key. Results are handed out by take(), which
+    waits for a job that is already running instead of starting it a
+    second time."""
+
+    def __init__(self, workers=1):
+        self.executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix='termpub-prefetch')
+        self.jobs = {}
+        self.lock = threading.Lock()
+
+    def schedule(self, key, function, *args):
+        with self.lock:
+            if key not in self.jobs:
+                self.jobs[key] = self.executor.submit(function, *args)
+
+    def take(self, key):
+        """Return the result of job key or None if there is no such job."""
+        with self.lock:
+            future = self.jobs.pop(key, None)
+        if future is None:
+            return None
+        try:
+            return future.result()
+        except CancelledError:
+            return None
+        except Exception:
+            ## let the caller run the job again and see the error
+            return None
+
+    def retain(self, keys):
+        """Cancel all jobs not in keys."""
+        with self.lock:
+            for key in list(self.jobs):
+                if key not in keys:
+                    self.jobs.pop(key).cancel()
+
+    def cancel(self):
+        self.retain(())
+
+    def shutdown(self):
+        self.cancel()
+        self.executor.shutdown(wait=False)
@@ -1,17 +1,23 @@
+from termpub.cache import RenderCache
+from termpub.commands import parse_bool
 from termpub.pager import Pager, TextPager, HTMLPager
+from termpub.prefetch import Prefetcher
+from termpub.search import SearchIndex
+from termpub.state import StateStore, Autosave, Markers
+from termpub.hyphenation import Hyphenator, pyphen_available
 from termpub.renderer import Renderer
 from termpub.exec import xdg_open
+import collections
 import curses
 import json
 import os
 import os.path
 import time
 import posixpath
-import re
-import sqlite3
-import tempfile
+import signal
 import termpub.width as width
-from xml.dom.minidom import parseString
+from array import array
+from bisect import bisect_left
 
 class Reader(Pager):
 
@@ -20,15 +26,34 @@ class Reader(Pager):
         width=80,
         hyphenate=False,
         dbfile=None,
+        cachefile=None,
+        searchfile=None,
+        hyphenfile=None,
+        resourcedir=None,
+        prefetch=1,
+        autosave=30,
+        autosave_turns=20,
+        fill='greedy',
+        windowed=True,
+        smartcase=False,
+        literal=False,
         status_left=None,
         status_right=None,
+        goto=None,
     ):
         super().__init__(stdscr)
 
+        self.windowed = parse_bool(windowed, 'windowed')
+        self.smartcase = parse_bool(smartcase, 'smartcase')
+        self.literal = parse_bool(literal, 'literal')
+
         self.epub = epub
         self.chapter = None
         self.chapters = self.epub.chapters
         self.chapter_index = 0
+        self.chapter_files = None
+        self.resourcedir = resourcedir
+        self.tempdir = None
         self.pads = [None] * len(self.chapters)
         self.pad = None
         self.current_line = 0
@@ -38,7 +63,13 @@ class Reader(Pager):
         else:
             self.title = epub.title
 
-        self.dbfile = dbfile
+        ## shown after curses ended
+        self.exit_message = None
+        self.exiting = False
+
+        self.state = None
+        if dbfile:
+            self.state = StateStore(dbfile)
 
         if self.max_x > width:
             self.width = width
@@ -46,6 +77,19 @@ class Reader(Pager):
         self.locations = []
         self.render_cache = {}
 
+        ## taken once, the file may change while it is read
+        self.epub_fingerprint = self.epub.fingerprint()
+        self.epub_hash = self.load_hash()
+
+        self.disk_cache = None
+        if cachefile:
+            self.disk_cache = RenderCache(cachefile)
+
+        self.prefetch_depth = int(prefetch)
+        self.prefetcher = None
+        if self.prefetch_depth > 0:
+            self.prefetcher = Prefetcher()
+
         if status_left:
             self.status_left = status_left
 
@@ -55,24 +99,47 @@ class Reader(Pager):
             self.status_right = '{current_page}---{chapter_counter}--{percent:->4}--'
 
         self.dic=None
-        if hyphenate:
+        self.hyphenation_language = ''
+        if hyphenate and pyphen_available():
             lang = epub.language or language
-            try:
-                import pyphen
-                self.dic = pyphen.Pyphen(lang=lang)
-            except ModuleNotFoundError:
-                pass
-
-        restored=0
-        if self.dbfile and os.path.isfile(self.dbfile):
+            self.dic = Hyphenator(lang, hyphenfile)
+            self.hyphenation_language = lang
+
+        self.fill = fill
+
+        ## Cached chapters are keyed by everything besides the width that
+        ## changes the rendered text.
+        self.render_variant = self.hyphenation_language
+        if fill != 'greedy':
+            self.render_variant += ':' + fill
+
+        self.search_index = SearchIndex(
+            self.epub_hash, self.render_variant, searchfile)
+
+        ## markers and history are read from the database on first use
+        self.position = Markers(self.state, self.epub_hash)
+
+        if goto:
+            self.restore_position(Position(*goto))
+        elif self.state:
             position = self.load_state()
             if position:
                 self.restore_position(position)
-                restored = 1
 
-        if not restored:
+        ## nothing to restore, or the position was in an unknown file
+        if self.chapter is None:
             self.load_start_chapter()
 
+        self.autosave = None
+        if self.state:
+            self.saved_state = self.get_state()
+            if int(autosave) > 0:
+                self.autosave = Autosave(
+                    self.state, int(autosave), int(autosave_turns))
+            ## a closed terminal or a kill should not lose the session
+            signal.signal(signal.SIGHUP, self.handle_signal)
+            signal.signal(signal.SIGTERM, self.handle_signal)
+
         self.keys = self.keys.copy()
 
         self.keys[']'] = 'next_chapter'
@@ -84,25 +151,22 @@ class Reader(Pager):
         self.keys['o'] = 'follow_link'
         self.keys["m"] = 'save_marker'
         self.keys["'"] = 'goto_marker'
+        self.keys['CTRL-O'] = 'goto_prev_position'
+        self.keys['TAB'] = 'goto_next_position'
         self.keys['\\'] = 'show_source'
 
     def get_position(self):
-        position = 0
-        for idx, line in enumerate(self.lines):
-            if idx <= self.y - 1:
-                position += width.width(line)
-            else:
-                break
-        position += 1
+        position = self.rendered.character_offset(self.y) + 1
         return Position(self.chapter.file, position)
 
-    def save_movement_marker(self):
-        self.position["'"] = self.get_position()
+    def save_movement_marker(self, history=True):
+        position = self.get_position()
+        self.position.set("'", position)
+        ## page turns only move the ' marker, they would flood the history
+        if history:
+            self.position.record(position)
 
     def restore_position(self, position):
-        if self.load_chapter_by_file(position.file) is None:
-            self.show_error("Can't restore position: file unknown.")
-
         if position is None:
             self.show_error('Position not set.')
             return
@@ -111,39 +175,55 @@ class Reader(Pager):
             self.show_error("Can't restore position: file unknown.")
             return
 
-        count=0
-        for idx, line in enumerate(self.lines):
-            count += width.width(line)
-            if count >= position.character:
+        while True:
+            idx = self.rendered.find_character(position.character)
+            if idx is not None:
+                self.require_lines(idx + 2 * self.max_y)
                 self.y = idx
                 return
+            count = len(self.lines)
+            self.require_lines(count + self.max_y)
+            if len(self.lines) == count:
+                break
         self.show_error("Can't restore mark: character not found.")
 
     def save_marker(self):
         """Marks the current position by the following letter"""
         marker = self.getkey()
-        self.position[marker] = self.get_position()
+        self.position.set(marker, self.get_position())
 
     def goto_next_match(self):
-        if self.pattern and super().goto_next_match() is False:
-            for idx, chapter in enumerate(self.chapters):
-                if idx > self.chapter_index:
-                    rendered = self.render_chapter(chapter)
-                    if re.search(self.pattern, ''.join(rendered.lines)):
-                        self.load_chapter(idx)
-                        super().goto_next_match()
-                        break
+        if self.matcher and super().goto_next_match() is False:
+            for idx in range(self.chapter_index + 1, len(self.chapters)):
+                text = self.chapter_text(self.chapters[idx])
+                line = text.find_next(self.matcher)
+                if line is not None:
+                    self.load_chapter(idx)
+                    self.require_lines(line + self.max_y)
+                    self.y = line
+                    break
 
     def goto_prev_match(self):
-        if self.pattern and super().goto_prev_match() is False:
-            for idx, chapter in reversed(list(enumerate(self.chapters))):
-                if idx < self.chapter_index:
-                    rendered = self.render_chapter(chapter)
-                    if re.search(self.pattern, ''.join(rendered.lines)):
-                        self.load_chapter(idx)
-                        self.goto_end()
-                        super().goto_prev_match()
-                        break
+        if self.matcher and super().goto_prev_match() is False:
+            for idx in range(self.chapter_index - 1, -1, -1):
+                text = self.chapter_text(self.chapters[idx])
+                line = text.find_prev(self.matcher)
+                if line is not None:
+                    self.load_chapter(idx)
+                    self.require_lines(line + self.max_y)
+                    self.y = line
+                    break
+
+    def chapter_text(self, chapter):
+        """Return the plain text of chapter from the search index, chapters
+        not in the index yet are rendered and added."""
+        text = self.search_index.get(self.width, chapter.file)
+        if text is None:
+            rendered = self.render_chapter(chapter)
+            rendered.extend()
+            text = self.search_index.add(
+                self.width, chapter.file, rendered.lines)
+        return text
 
     def goto_marker(self):
         """Restore position marked by the following letter"""
@@ -151,7 +231,23 @@ class Reader(Pager):
         position = self.position.get(marker)
         if position:
             self.save_movement_marker()
-            self.restore_position(position)
+            self.restore_position(Position(*position))
+
+    def goto_prev_position(self):
+        """Go back to the position before the last large movement"""
+        position = self.position.back(self.get_position())
+        if position:
+            self.restore_position(Position(*position))
+        else:
+            self.show_msg('Already at oldest position.')
+
+    def goto_next_position(self):
+        """Go forward again in the history of large movements"""
+        position = self.position.forward()
+        if position:
+            self.restore_position(Position(*position))
+        else:
+            self.show_msg('Already at newest position.')
 
     def follow_link(self):
         """Follow link N"""
@@ -171,6 +267,8 @@ class Reader(Pager):
     def goto_location(self, url):
         if url.scheme != '':
             xdg_open(url.geturl())
+            ## the external program wrote over the screen
+            self.redraw()
             return True
 
         index = self.find_chapter(url.path)
@@ -181,15 +279,33 @@ class Reader(Pager):
             self.load_chapter(index)
             fragment = url.fragment
             if fragment:
-                line = self.ids.get(fragment)
+                line = self.rendered.find_id(fragment)
                 if line:
+                    self.require_lines(line + self.max_y)
                     self.y = line
             return True
 
-        with tempfile.TemporaryDirectory() as dir:
-            file = self.epub.zip.extract(url.path, path=dir)
-            xdg_open(file)
-            return True
+        try:
+            file = self.epub.export(url.path, self.resource_dir())
+        except KeyError:
+            self.show_error(f'{url.path} not found in book.')
+            return False
+        xdg_open(file)
+        self.redraw()
+        return True
+
+    def resource_dir(self):
+        """Return the directory linked files of the book are exported to.
+
+        Files are kept there, so opening them again does not need to
+        extract them. Without a resourcedir, a temporary directory is used
+        for the session."""
+        if self.resourcedir:
+            return os.path.join(self.resourcedir, self.epub_hash)
+        if self.tempdir is None:
+            import tempfile
+            self.tempdir = tempfile.TemporaryDirectory(prefix='termpub-')
+        return self.tempdir.name
 
     def first_chapter(self):
         """Goto first chapter"""
@@ -215,6 +331,7 @@ class Reader(Pager):
         self.chapter_index = num
         self.chapter = self.chapters[num]
         self.render_pad()
+        self.prefetch()
 
     def goto_toc(self):
         """Show the table of contents"""
@@ -241,9 +358,11 @@ class Reader(Pager):
         TextPager(self.stdscr, lines, title='Help').update()
 
     def find_chapter(self,file):
-        for index,chapter in enumerate(self.chapters):
-            if chapter.file == file:
-                return index
+        if self.chapter_files is None:
+            self.chapter_files = {}
+            for index, chapter in enumerate(self.chapters):
+                self.chapter_files.setdefault(chapter.file, index)
+        return self.chapter_files.get(file)
 
     def load_start_chapter(self):
         if self.epub.bodymatter:
@@ -267,26 +386,103 @@ class Reader(Pager):
         if rendered is not None:
             return rendered
 
-        renderer = Renderer(self.width, dic=self.dic, base_url=chapter.file)
-        lines, ids, locations = renderer.render(chapter.source)
-        rendered = RenderedChapter(lines, ids, locations)
+        if self.prefetcher:
+            rendered = self.prefetcher.take((chapter.file, self.width))
+
+        if rendered is None:
+            rendered = self.build_chapter(chapter, self.width)
 
         self.render_cache[chapter.file] = rendered
         return rendered
 
+    def build_chapter(self, chapter, width):
+        ## Called from the prefetch thread too, so don't touch any state
+        ## that depends on the current chapter or width.
+        cached = None
+        if self.disk_cache:
+            cached = self.disk_cache.get(self.epub_hash, chapter.file,
+                width, self.render_variant)
+
+        if cached is not None:
+            return RenderedChapter(*cached)
+
+        renderer = Renderer(width, dic=self.dic, base_url=chapter.file,
+            fill=self.fill)
+        rendered = RenderedChapter(renderer=renderer, source=chapter.source)
+        if self.disk_cache:
+            def store(rendered):
+                self.disk_cache.put(self.epub_hash, chapter.file, width,
+                    self.render_variant, rendered.lines, rendered.ids,
+                    rendered.locations)
+            rendered.on_complete = store
+        return rendered
+
+    def prefetch_chapter(self, chapter, width):
+        rendered = self.build_chapter(chapter, width)
+        rendered.extend()
+        return rendered
+
+    def prefetch(self):
+        """Render the chapters around the current one in the background."""
+        if not self.prefetcher:
+            return
+
+        keys = []
+        for distance in range(1, self.prefetch_depth + 1):
+            for index in (self.chapter_index + distance,
+                    self.chapter_index - distance):
+                if 0 <= index < len(self.chapters):
+                    chapter = self.chapters[index]
+                    if chapter.file not in self.render_cache:
+                        keys.append((chapter, (chapter.file, self.width)))
+
+        self.prefetcher.retain([key for _, key in keys])
+        for chapter, key in keys:
+            self.prefetcher.schedule(
+                key, self.prefetch_chapter, chapter, self.width)
+
     def set_width(self, width=None):
         """Set width to N"""
         ## invalidate render_cache if width is changed
         self.render_cache = {}
+        if self.prefetcher:
+            self.prefetcher.cancel()
         super().set_width(width=width)
+        self.prefetch()
+
+    def resize(self):
+        ## Pager.resize narrows width to the new screen and renders the pad,
+        ## chapters rendered at the old width have to be dropped before
+        if self.stdscr.getmaxyx()[1] - 1 < self.width:
+            self.render_cache = {}
+        if self.prefetcher:
+            self.prefetcher.cancel()
+        super().resize()
+        self.prefetch()
 
     def get_lines(self):
         chapter = self.chapter
         rendered = self.render_chapter(chapter)
+        ## only render what is needed for the first screen
+        rendered.extend(self.y + 2 * self.max_y)
+        self.rendered = rendered
+        self.rendered_restarts = rendered.restarts
         self.locations = rendered.locations
         self.ids = rendered.ids
         return rendered.lines
 
+    def require_lines(self, count=None):
+        added = self.rendered.extend(count)
+        if self.rendered_restarts != self.rendered.restarts:
+            ## the lines on the pad were thrown away
+            self.render_pad()
+            added = self.rendered.extend(count)
+        if added:
+            self.add_lines()
+
+    def line_count(self):
+        return self.rendered.line_count()
+
     def next_chapter(self):
         """Go to the next chapter """
         old = self.chapter_index
@@ -305,8 +501,25 @@ class Reader(Pager):
 
     def exit(self):
         """Exit termpub"""
-        if self.dbfile:
-            self.save_state()
+        if self.exiting:
+            return
+        self.exiting = True
+        if self.autosave:
+            self.autosave.stop()
+            self.autosave = None
+        if self.state:
+            state, self.state = self.state, None
+            self.write_state(state, self.get_state())
+            if not state.close():
+                self.exit_message = ('the state database is locked, the '
+                    'reading position was not saved.')
+        if self.prefetcher:
+            self.prefetcher.shutdown()
+        self.search_index.close()
+        if self.dic:
+            self.dic.close()
+        if self.tempdir:
+            self.tempdir.cleanup()
         return super().exit()
 
     def update_status_data(self):
@@ -320,8 +533,9 @@ class Reader(Pager):
             file = self.chapters[self.chapter_index].file
             for url, text in self.epub.nav_doc.page_list.items():
                 if url.path == file:
-                    line = self.ids[url.fragment]
-                    if line > self.y:
+                    line = self.ids.get(url.fragment)
+                    ## pages not rendered yet are after the current line
+                    if line is None or line > self.y:
                         break
                     data['current_page'] = 'p.' + text
 
@@ -329,45 +543,147 @@ class Reader(Pager):
 
     def show_source(self):
         """Show source of rendered document"""
+        from xml.dom.minidom import parseString
         source = self.chapters[self.chapter_index].source
         lines = parseString(source).toprettyxml(indent="  ").splitlines()
         TextPager( self.stdscr, lines, title='Source').update()
 
-    def save_state(self):
-        position = self.get_position()
-        hash = self.epub.hash()
-        with sqlite3.connect(self.dbfile) as con:
-            con.execute("""
-                CREATE TABLE IF NOT EXISTS states (
-                    hash      TEXT NOT NULL PRIMARY KEY,
-                    filename  TEXT,
-                    chapter   TEXT,
-                    position  INTEGER,
-                    last_read REAL
-                )
-            """)
-            con.execute('PRAGMA user_version = 2;')
-            con.execute('INSERT OR REPLACE INTO states VALUES (?,?,?,?,?)',
-                (hash, os.path.abspath(self.epub.file),
-                    position.file, position.character, time.time()))
+    def load_hash(self):
+        """Return the hash of the epub.
+
+        Hashing has to read the central directory of the zip file, so
+        the hash is stored together with path, size and modification time
+        of the file and only computed again if one of them changed."""
+        if self.state:
+            hash = self.state.get_hash(*self.epub_fingerprint)
+            if hash:
+                return hash
+        return self.epub.hash()
+
+    def get_state(self):
+        """Return the position to save and the version of the markers,
+        which queue their own changes."""
+        return tuple(self.get_position()), self.position.version
+
+    def write_state(self, store, state):
+        """Queue a state returned by get_state on store. This only uses
+        values fixed on startup, so it can run on another thread."""
+        position, version = state
+        path, size, mtime = self.epub_fingerprint
+        store.put_state(self.epub_hash, path, *position)
+        store.put_file(path, size, mtime, self.epub_hash)
+
+    def command_done(self):
+        if not self.autosave:
+            return
+        state = self.get_state()
+        if state != self.saved_state:
+            self.saved_state = state
+            self.autosave.mark(lambda store: self.write_state(store, state))
+
+    def handle_signal(self, signum, frame):
+        ## Only unwind, the caller runs exit(). The main thread may hold the
+        ## store's locks here, they are released on the way out. A second
+        ## signal must not interrupt exit while it writes the state.
+        if self.exiting:
+            return
+        raise SystemExit(128 + signum)
 
     def load_state(self):
-        hash = self.epub.hash()
-        with sqlite3.connect(self.dbfile) as con:
-            con.row_factory = sqlite3.Row
-            cur = con.execute('SELECT * FROM states WHERE hash = ?', (hash,))
-            result = cur.fetchone()
-            if result:
-                result = dict(result)
-                return Position(result['chapter'], result['position'])
-
-class Position():
-    def __init__(self, file, character):
-        self.file = file
-        self.character = character
+        result = self.state.get_state(self.epub_hash)
+        if result:
+            return Position(*result)
+
+Position = collections.namedtuple('Position', ['file', 'character'])
 
 class RenderedChapter():
-    def __init__(self, lines, ids, locations):
-        self.lines = lines
-        self.ids = ids
-        self.locations = locations
+    """Lines, ids and locations of a chapter.
+
+    If the chapter is created from a Renderer, its events are only
+    consumed as far as they are needed. lines, ids and locations grow in
+    place, so references to them stay valid until the renderer restarts
+    the chapter. They are replaced by new ones then and restarts is
+    incremented."""
+
+    def __init__(self, lines=None, ids=None, locations=None, renderer=None,
+            source=None):
+        self.lines = lines if lines is not None else []
+        self.ids = ids if ids is not None else {}
+        self.locations = locations if locations is not None else []
+        self.renderer = renderer
+        self.events = None
+
+        ## offsets[n] is the number of characters in the first n lines
+        self.offsets = array('Q', [0])
+
+        self.complete = True
+        self.on_complete = None
+        self.restarts = 0
+        if renderer is not None:
+            self.events = renderer.events(source)
+            self.complete = False
+
+    def extend(self, count=None):
+        """Render until there are count lines, or everything if count is
+        None. Returns True if lines were added."""
+        old = len(self.lines)
+        if count is None:
+            self.render_until(lambda: False)
+        else:
+            self.render_until(lambda: len(self.lines) >= count)
+        return len(self.lines) > old
+
+    def find_id(self, id):
+        """Render until id is found and return its line."""
+        self.render_until(lambda: id in self.ids)
+        return self.ids.get(id)
+
+    def update_offsets(self):
+        total = self.offsets[-1]
+        for line in self.lines[len(self.offsets) - 1:]:
+            total += width.length(line)
+            self.offsets.append(total)
+
+    def character_offset(self, line):
+        """Return the number of characters before line."""
+        self.update_offsets()
+        return self.offsets[min(line, len(self.offsets) - 1)]
+
+    def find_character(self, character):
+        """Return the line containing the character at offset character,
+        or None if it is not rendered yet."""
+        self.update_offsets()
+        if self.offsets[-1] < character:
+            return None
+        return max(bisect_left(self.offsets, character, 1) - 1, 0)
+
+    def render_until(self, done):
+        if self.complete or done():
+            return
+
+        for event in self.events:
+            if event[0] == 'line':
+                self.lines.append(event[1])
+            elif event[0] == 'id':
+                self.ids[event[1]] = event[2]
+            elif event[0] == 'location':
+                self.locations.append(event[1])
+            else:
+                self.lines, self.ids, self.locations = [], {}, []
+                self.offsets = array('Q', [0])
+                self.restarts += 1
+            if done():
+                return
+
+        self.complete = True
+        self.events = None
+        self.renderer = None
+        if self.on_complete:
+            self.on_complete(self)
+
+    def line_count(self):
+        """Number of lines, estimated if the chapter is not complete."""
+        if self.complete or not self.renderer.progress:
+            return len(self.lines)
+        return max(len(self.lines),
+            int(len(self.lines) / self.renderer.progress))
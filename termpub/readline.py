@@ -59,9 +59,6 @@ def readline(
 
     iter=None
 
-    ## TODO len() is wrong for non-ascii characters;
-    ## to compute display length, just insert it into a pad and
-    ## check how much the cursor moved?
     left_pad  = width.width(prompt);
 
     right_pad = 1 # for cursor
@@ -139,7 +136,7 @@ def readline(
             if not iter and completion_function:
                 line = ''.join(buffer.graphemes[:buffer.index])
                 iter, token = completion_iterator(line, completion_function)
-                start = buffer.index - width.width(token)
+                start = buffer.index - width.length(token)
                 end = buffer.index
 
             if iter:
@@ -1,29 +1,93 @@
+from html.entities import name2codepoint
 from html.parser import HTMLParser
 import re
+import xml.etree.ElementTree as ET
 import termpub.width as width
 from termpub.urls import urlparse
 
+## Chapters with an XHTML DOCTYPE may use the named entities of HTML. Expat
+## does not read the external DTD, ElementTree looks them up here instead.
+HTML_ENTITIES = {name: chr(code) for name, code in name2codepoint.items()}
+
+class XMLTarget():
+    """Passes the events of an xml parser on to a Renderer, in the same
+    way as html.parser does."""
+
+    def __init__(self, renderer):
+        self.renderer = renderer
+        self.text = []
+
+        ## html.parser does not look for tags inside script and style
+        ## elements, so their descendants are skipped.
+        self.raw = 0
+
+    def flush_text(self):
+        if self.text:
+            self.renderer.handle_data(''.join(self.text))
+            self.text = []
+
+    def start(self, tag, attrib):
+        if self.raw:
+            self.raw += 1
+            return
+        self.flush_text()
+        tag = tag.rpartition('}')[2].lower()
+        if tag in HTMLParser.CDATA_CONTENT_ELEMENTS:
+            self.raw = 1
+        self.renderer.start_tag(tag, {
+            key.lower(): value
+            for key, value in attrib.items()
+            if key[0] != '{'
+        })
+
+    def end(self, tag):
+        if self.raw > 1:
+            self.raw -= 1
+            return
+        self.raw = 0
+        self.flush_text()
+        self.renderer.end_tag(tag.rpartition('}')[2].lower())
+
+    def data(self, data):
+        self.text.append(data)
+
+    ## Comments and processing instructions split the text around them.
+    def comment(self, text):
+        if not self.raw:
+            self.flush_text()
+
+    def pi(self, target, data):
+        if not self.raw:
+            self.flush_text()
+
+    def close(self):
+        self.flush_text()
+
 class Renderer(HTMLParser):
 
-    noshow = [
+    ## Bump whenever the rendered output changes, this invalidates all
+    ## persistently cached chapters.
+    version = 3
+
+    noshow = frozenset([
         'base', 'basefont', 'bgsound', 'meta', 'param', 'script', 'style',
         'head'
-    ]
+    ])
 
-    empty  = [
+    empty  = frozenset([
         'br', 'canvas', 'col', 'command', 'embed', 'frame', 'img', 'is',
         'index', 'keygen', 'link'
-    ]
+    ])
 
-    inline = [
+    inline = frozenset([
         'a', 'abbr', 'area', 'b', 'bdi', 'bdo', 'big', 'button', 'cite',
         'code', 'dfn', 'em', 'font', 'i', 'input', 'kbd', 'label', 'mark',
         'meter', 'nobr', 'progress', 'q', 'rp', 'rt', 'ruby', 's', 'samp',
         'small', 'span', 'strike', 'strong', 'sub', 'sup', 'time', 'tt', 'u',
         'var', 'wbr'
-    ]
+    ])
 
-    block = [
+    block = frozenset([
         'address', 'applet', 'article', 'aside', 'audio', 'blockquote', 'body',
         'caption', 'center', 'colgroup', 'datalist', 'del', 'dir', 'div', 'dd',
         'details', 'dl', 'dt', 'fieldset', 'figcaption', 'figure', 'footer',
@@ -33,105 +97,280 @@ class Renderer(HTMLParser):
         'noscript', 'object', 'ol', 'optgroup', 'option','p', 'pre', 'select',
         'section', 'source', 'summary', 'table', 'tbody', 'td', 'tfoot', 'th',
         'thead', 'title', 'tr', 'track', 'ul', 'video'
-    ]
+    ])
+
+    headings = { f'h{level}': level for level in range(1, 7) }
+
+    ## Repeated once per heading level in front of headings.
+    heading_mark = '='
 
-    def __init__(self, width=80, dic=None, base_url=None):
+    def __init__(self, width=80, dic=None, base_url=None, fill='greedy',
+            parser='auto'):
         self.width = width
         self.dic = dic
         self.base_url = base_url
+        self.fill = fill
+        self.parser = parser
         super().__init__()
 
     def render(self, html):
+        lines = []
+        ids = {}
+        locations = []
+        for event in self.events(html):
+            if event[0] == 'line':
+                lines.append(event[1])
+            elif event[0] == 'id':
+                ids[event[1]] = event[2]
+            elif event[0] == 'location':
+                locations.append(event[1])
+            else:
+                lines, ids, locations = [], {}, []
+        return lines, ids, locations
+
+    def events(self, html, chunk_size=64 * 1024):
+        """Render html and yield the result while it is parsed.
+
+        Yields ('line', line), ('id', id, line_number) and
+        ('location', url) tuples. Lines are yielded in order, ids and
+        locations as soon as they are known. ('restart',) means that
+        everything yielded before it is to be thrown away, the chapter is
+        rendered again from the start. self.progress is the parsed
+        fraction of html."""
+
+        ## Chapters are parsed by expat, which should succeed for all of
+        ## them, and only parsed again by html.parser if it fails. The two
+        ## parsers don't render every document the same way, so an error
+        ## after the first chunk restarts the chapter.
+        if self.parser == 'html':
+            yield from self.parse_events(self.parse_html, html, chunk_size)
+            return
+
+        started = False
+        try:
+            for event in self.parse_events(self.parse_xml, html, chunk_size):
+                started = True
+                yield event
+            return
+        except ET.ParseError:
+            if self.parser == 'xml':
+                raise
+
+        if started:
+            yield ('restart',)
+        yield from self.parse_events(self.parse_html, html, chunk_size)
+
+    def parse_events(self, parse, html, chunk_size):
         self.chunks = []
         self.lines = []
+        self.line_offset = 0
         self.pending_ids = []
+        self.new_ids = []
         self.locations = []
-        self.id_positions = {}
+        self.location_count = 0
         self.ignore = 0
         self.hanging_indent = 0
         self.indent = 0
 
-        self.feed(html)
+        self.progress = 0
+        for _ in parse(html, chunk_size):
+            yield from self.flush()
 
         while self.lines and self.lines[-1] == '':
             del self.lines[-1]
 
-        locations = [urlparse(x, self.base_url) for x in self.locations]
+        yield from self.flush(final=True)
+
+    def split(self, html, chunk_size):
+        ## Only split the input in front of a tag, so text nodes are never
+        ## cut in half.
+        start = 0
+        while start < len(html):
+            end = html.find('<', start + chunk_size)
+            if end == -1:
+                end = len(html)
+            yield html[start:end]
+            start = end
+            self.progress = start / len(html)
+
+    def parse_html(self, html, chunk_size):
+        for chunk in self.split(html, chunk_size):
+            self.feed(chunk)
+            yield
+
+    def parse_xml(self, html, chunk_size):
+        parser = ET.XMLParser(target=XMLTarget(self))
+        parser.entity.update(HTML_ENTITIES)
+        for chunk in self.split(html, chunk_size):
+            parser.feed(chunk)
+            yield
+        parser.close()
+
+    def flush(self, final=False):
+        ## The last non-empty line and any empty lines after it are kept
+        ## back. New blocks look at the last line and empty lines at the end
+        ## of the chapter are removed.
+        keep = len(self.lines)
+        if not final:
+            keep -= 1
+            while keep >= 0 and self.lines[keep] == '':
+                keep -= 1
+
+        if keep > 0:
+            for line in self.lines[:keep]:
+                yield ('line', line)
+            self.line_offset += keep
+            del self.lines[:keep]
+
+        for id, line_number in self.new_ids:
+            yield ('id', id, line_number)
+        self.new_ids = []
+
+        for location in self.locations:
+            yield ('location', urlparse(location, self.base_url))
+        self.locations = []
+
+    def add_location(self, url):
+        self.locations.append(url)
+        self.location_count += 1
+        return self.location_count
 
-        return self.lines, self.id_positions, locations
+    ## Splitting with a group keeps the separators: words are at even,
+    ## whitespace at odd indices.
+    ## TODO zero width space? no break?
+    word_separator = re.compile(r'(\s+)')
 
     def fill_text(self):
         if not self.chunks:
             return
 
         if self.hanging_indent:
-            current_line_length = self.indent - 2
-            current_line = ' ' * (self.indent -  2)
+            first_indent = self.indent - 2
         else:
-            current_line_length = self.indent 
-            current_line = ' ' * self.indent
+            first_indent = self.indent
 
-        ## TODO zero width space? no break?
-        word_seperator = re.compile(r'(\s+)')
-
-        chunks = []
+        tokens = []
+        split = self.word_separator.split
         for x in self.chunks:
             if isinstance(x, tuple):
                 self.pending_ids.append(x[0])
                 continue
-            for y in word_seperator.split(x):
-                chunks.append(y)
-
-        ## TODO word too long for line?
-        for chunk in chunks:
+            for idx, token in enumerate(split(x)):
+                if idx % 2:
+                    tokens.append(' ')
+                elif token:
+                    tokens.append(token)
+
+        if self.fill == 'optimal':
+            self.fill_optimal(tokens, first_indent)
+        else:
+            self.fill_greedy(tokens, first_indent)
 
+        self.chunks = []
 
-            chunk.replace('\n','')
-            chunk = re.sub(r'\s+', ' ', chunk)
+    def fill_greedy(self, tokens, first_indent):
+        indent = self.indent
+        max_width = self.width
+        line = [' ' * first_indent]
+        line_length = first_indent
 
-            chunk_length = width.width(chunk)
+        ## TODO word too long for line?
+        for token in tokens:
+            token_length = width.width(token)
 
-            if current_line_length + chunk_length > self.width:
+            if line_length + token_length > max_width:
 
                 if self.dic:
-                    remaining = self.width - current_line_length
-                    for pair in self.dic.iterate(chunk):
-                        if width.width(pair[0]) + 1 <= remaining:
-                            current_line += pair[0] + '-'
-                            chunk = pair[1]
-                            break
-
-                self.add_new_line(current_line)
-                current_line_length = self.indent
-                current_line = ' ' * self.indent
-
-            if word_seperator.match(chunk) and current_line_length == self.indent:
-                continue
+                    pair = self.dic.split(token, max_width - line_length)
+                    if pair:
+                        line.append(pair[0] + '-')
+                        token = pair[1]
 
+                self.add_new_line(''.join(line))
+                line = [' ' * indent]
+                line_length = indent
 
-            if chunk_length < 0:
-                raise Exception('indent negative')
+            if token == ' ' and line_length == indent:
+                continue
 
-            current_line += chunk
-            current_line_length += chunk_length
+            line.append(token)
+            line_length += token_length
+
+        self.add_new_line(''.join(line))
+
+    def fill_optimal(self, tokens, first_indent):
+        """Break lines so that the sum of the squared space left at the end
+        of every line but the last is minimal."""
+        words = []
+        word = []
+        for token in tokens:
+            if token == ' ':
+                if word:
+                    words.append(''.join(word))
+                    word = []
+            else:
+                word.append(token)
+        if word:
+            words.append(''.join(word))
+        if not words:
+            return
 
-        self.add_new_line(current_line)
-
-        self.chunks = []
+        lengths = [width.width(x) for x in words]
+        count = len(words)
+
+        ## cost[j] is the cost of the best breaks for the first j words,
+        ## start[j] the first word of the last line of that solution.
+        cost = [0] + [None] * count
+        start = [0] * (count + 1)
+        for j in range(1, count + 1):
+            line_length = -1
+            for i in range(j - 1, -1, -1):
+                line_length += lengths[i] + 1
+                if i == 0:
+                    available = self.width - first_indent
+                else:
+                    available = self.width - self.indent
+                ## a word longer than the line gets a line of its own
+                if line_length > available and i < j - 1:
+                    break
+                if j == count:
+                    badness = 0
+                else:
+                    badness = max(available - line_length, 0) ** 2
+                if cost[j] is None or cost[i] + badness < cost[j]:
+                    cost[j] = cost[i] + badness
+                    start[j] = i
+
+        breaks = []
+        j = count
+        while j > 0:
+            breaks.append((start[j], j))
+            j = start[j]
+
+        for i, j in reversed(breaks):
+            indent = first_indent if i == 0 else self.indent
+            self.add_new_line(' ' * indent + ' '.join(words[i:j]))
 
     def add_new_line(self, line):
-        if not re.match(r'^\s*$', line):
+        if line and not line.isspace():
             for id in self.pending_ids:
-                self.id_positions[id] = len(self.lines)
+                self.new_ids.append((id, self.line_offset + len(self.lines)))
             self.pending_ids = []
             self.lines.append( line.rstrip() )
 
     def handle_starttag(self, tag, attrs):
-        attrs = dict(attrs)
+        ## remove namespace
+        if ':' in tag:
+            tag = tag.split(':', 1)[-1]
+        self.start_tag(tag, dict(attrs))
 
+    def handle_endtag(self, tag):
         ## remove namespace
-        tag = tag.split(':', 1)[-1]
+        if ':' in tag:
+            tag = tag.split(':', 1)[-1]
+        self.end_tag(tag)
 
+    def start_tag(self, tag, attrs):
         if tag in self.noshow:
             self.ignore += 1
 
@@ -147,23 +386,20 @@ class Renderer(HTMLParser):
             ## TODO Why ,1???
             self.chunks.append((attrs['id'], 1))
 
-        m = re.match(r'h(\d)', tag)
-        if m:
-            self.chunks.append(('=' * int(m.group(1))) + ' ');
+        if tag in self.headings:
+            self.chunks.append(self.heading_mark * self.headings[tag] + ' ')
 
         elif tag == 'img':
             alt = attrs.get('alt') or ''
             src = attrs.get('src')
             if src:
-                self.locations.append(src)
-                num = len(self.locations)
+                num = self.add_location(src)
             self.chunks.append(f'![{num}][{alt}]')
 
         elif tag == 'a':
             href = attrs.get('href')
             if href:
-                self.locations.append(href)
-                num = len(self.locations)
+                num = self.add_location(href)
                 self.chunks.append(f'[{num}]')
 
         elif tag == 'br':
@@ -180,10 +416,7 @@ class Renderer(HTMLParser):
         elif tag == 'pre':
             self.fill_text()
 
-    def handle_endtag(self, tag):
-        ## remove namespace
-        tag = tag.split(':', 1)[-1]
-
+    def end_tag(self, tag):
         if tag == 'pre':
             for chunk in self.chunks:
                 for line in chunk.splitlines():
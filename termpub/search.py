@@ -0,0 +1,210 @@
+from array import array
+from bisect import bisect_right
+import re
+import sqlite3
+import time
+import zlib
+
+from termpub.cache import evict
+from termpub.renderer import Renderer
+
+class Matcher():
+    """A search pattern, compiled once.
+
+    With smartcase, a pattern without uppercase letters ignores case.
+    With literal, the pattern is plain text and is looked up with
+    str.find instead of the regex engine."""
+
+    def __init__(self, pattern, smartcase=False, literal=False):
+        self.pattern = pattern
+        self.literal = literal
+        self.ignore_case = smartcase and pattern == pattern.lower()
+
+        flags = re.M
+        if self.ignore_case:
+            flags |= re.I
+        if literal:
+            self.regex = re.compile(re.escape(pattern), flags)
+        else:
+            self.regex = re.compile(pattern, flags)
+
+        self.needle = pattern
+        if self.ignore_case:
+            self.needle = pattern.lower()
+
+    def search(self, text):
+        """Return True if text contains a match."""
+        if self.literal:
+            if self.ignore_case:
+                text = text.lower()
+            return self.needle in text
+        return self.regex.search(text) is not None
+
+    def fold(self, text):
+        """Return text as seen by a literal search, or None if the regex
+        engine has to be used."""
+        if not self.literal or not self.needle:
+            return None
+        if self.ignore_case:
+            folded = text.lower()
+            ## lower() may change the length of some characters, the
+            ## offsets would not match the original text anymore
+            if len(folded) != len(text):
+                return None
+            return folded
+        return text
+
+    def spans(self, text, start=0, end=None):
+        """Yield start and end offsets of all matches in text[start:end]."""
+        if end is None:
+            end = len(text)
+        folded = self.fold(text)
+        if folded is None:
+            for m in self.regex.finditer(text, start, end):
+                yield m.span()
+            return
+        size = len(self.needle)
+        index = folded.find(self.needle, start, end)
+        while index != -1:
+            yield index, index + size
+            index = folded.find(self.needle, index + size, end)
+
+    def first(self, text, start=0):
+        """Return the offset of the first match after start or None."""
+        for span in self.spans(text, start):
+            return span[0]
+        return None
+
+    def last(self, text, end=None):
+        """Return the offset of the last match before end or None."""
+        if end is None:
+            end = len(text)
+        folded = self.fold(text)
+        if folded is not None:
+            index = folded.rfind(self.needle, 0, end)
+            if index != -1:
+                return index
+            return None
+        found = None
+        for span in self.spans(text, 0, end):
+            found = span[0]
+        return found
+
+class ChapterText():
+    """Plain text of a rendered chapter with the offsets of its lines."""
+
+    def __init__(self, lines):
+        self.text = '\n'.join(lines)
+        self.offsets = array('L')
+        offset = 0
+        for line in lines:
+            self.offsets.append(offset)
+            offset += len(line) + 1
+
+    def line(self, offset):
+        """Return the line containing offset."""
+        return bisect_right(self.offsets, offset) - 1
+
+    def find_next(self, matcher, line=-1):
+        """Return the first line after line with a match or None."""
+        if line + 1 >= len(self.offsets):
+            return None
+        found = matcher.first(self.text, self.offsets[line + 1])
+        if found is not None:
+            return self.line(found)
+
+    def find_prev(self, matcher, line=None):
+        """Return the last line before line with a match or None."""
+        if line is None:
+            end = len(self.text)
+        elif line <= 0:
+            return None
+        else:
+            end = self.offsets[line] - 1
+        found = matcher.last(self.text, end)
+        if found is not None:
+            return self.line(found)
+
+class SearchIndex():
+    """Plain text of all chapters of a book, per width.
+
+    Texts are added as chapters are rendered. If file is set, the index
+    is stored in a sqlite database and loaded from there the first time
+    a width is searched. Like the render cache, texts of another renderer
+    version are dropped on open, and the texts of the books used least
+    recently are evicted once the database grows beyond max_size
+    bytes."""
+
+    def __init__(self, hash, language='', file=None,
+            max_size=32 * 1024 * 1024):
+        self.hash = hash
+        self.language = language or ''
+        self.file = file
+        self.max_size = max_size
+        self.texts = {}
+        self.loaded = set()
+        self.con = None
+        if file:
+            self.con = sqlite3.connect(file)
+            with self.con:
+                self.con.execute("""
+                    CREATE TABLE IF NOT EXISTS texts (
+                        hash      TEXT NOT NULL,
+                        width     INTEGER NOT NULL,
+                        language  TEXT NOT NULL,
+                        file      TEXT NOT NULL,
+                        version   INTEGER NOT NULL,
+                        size      INTEGER NOT NULL,
+                        last_used REAL NOT NULL,
+                        text      BLOB NOT NULL,
+                        PRIMARY KEY (hash, width, language, file)
+                    )
+                """)
+                self.con.execute(
+                    'CREATE INDEX IF NOT EXISTS texts_last_used '
+                    'ON texts (last_used)')
+                self.con.execute(
+                    'DELETE FROM texts WHERE version != ?',
+                    (Renderer.version,))
+
+    def load(self, width):
+        if width in self.loaded:
+            return
+        self.loaded.add(width)
+        if not self.con:
+            return
+        key = (self.hash, width, self.language)
+        cur = self.con.execute("""
+            SELECT file, text FROM texts
+            WHERE hash = ? AND width = ? AND language = ?
+        """, key)
+        for file, text in cur:
+            lines = zlib.decompress(text).decode().split('\n')
+            self.texts.setdefault((width, file), ChapterText(lines))
+        with self.con:
+            self.con.execute("""
+                UPDATE texts SET last_used = ?
+                WHERE hash = ? AND width = ? AND language = ?
+            """, (time.time(), *key))
+
+    def get(self, width, file):
+        self.load(width)
+        return self.texts.get((width, file))
+
+    def add(self, width, file, lines):
+        self.load(width)
+        text = ChapterText(lines)
+        self.texts[(width, file)] = text
+        if self.con:
+            data = zlib.compress(text.text.encode())
+            with self.con:
+                self.con.execute(
+                    'INSERT OR REPLACE INTO texts VALUES (?,?,?,?,?,?,?,?)',
+                    (self.hash, width, self.language, file, Renderer.version,
+                        len(data), time.time(), data))
+                evict(self.con, 'texts', self.max_size)
+        return text
+
+    def close(self):
+        if self.con:
+            self.con.close()
@@ -0,0 +1,304 @@
+import sqlite3
+import threading
+import time
+
+## Schema changes, applied in order to databases with a lower
+## user_version. Version 2 is the states table of older releases, which
+## set user_version without any migration.
+MIGRATIONS = [
+    (2, """
+        CREATE TABLE IF NOT EXISTS states (
+            hash      TEXT NOT NULL PRIMARY KEY,
+            filename  TEXT,
+            chapter   TEXT,
+            position  INTEGER,
+            last_read REAL
+        )
+    """),
+    (3, """
+        CREATE TABLE IF NOT EXISTS files (
+            path      TEXT NOT NULL PRIMARY KEY,
+            size      INTEGER NOT NULL,
+            mtime     INTEGER NOT NULL,
+            hash      TEXT NOT NULL
+        )
+    """),
+    (4, """
+        CREATE TABLE IF NOT EXISTS markers (
+            hash      TEXT NOT NULL,
+            name      TEXT NOT NULL,
+            chapter   TEXT NOT NULL,
+            position  INTEGER NOT NULL,
+            PRIMARY KEY (hash, name)
+        )
+    """),
+    (5, """
+        CREATE TABLE IF NOT EXISTS history (
+            hash      TEXT NOT NULL,
+            seq       INTEGER NOT NULL,
+            chapter   TEXT NOT NULL,
+            position  INTEGER NOT NULL,
+            PRIMARY KEY (hash, seq)
+        )
+    """),
+]
+
+class StateStore():
+    """Reading state of all books, stored in one sqlite database.
+
+    The database is opened once and kept open. It is put into WAL mode,
+    so readers do not wait for writers of other termpub instances. Writes
+    are queued and committed together in one short transaction by flush.
+    If the database stays locked for longer than timeout seconds, the
+    writes are kept for the next flush instead of blocking. The store can
+    be shared between threads, queueing a write never waits for a flush
+    in progress."""
+
+    def __init__(self, file, timeout=2.0):
+        self.file = file
+        ## lock guards the connection, queue_lock only the pending writes
+        self.lock = threading.Lock()
+        self.queue_lock = threading.Lock()
+        self.pending = []
+        self.con = sqlite3.connect(
+            file, timeout=timeout, check_same_thread=False)
+        self.con.execute('PRAGMA journal_mode = WAL')
+        ## in WAL mode a crash can only lose the last transactions, it
+        ## can not corrupt the database
+        self.con.execute('PRAGMA synchronous = NORMAL')
+        self.migrate()
+
+    def migrate(self):
+        version = self.con.execute('PRAGMA user_version').fetchone()[0]
+        for target, sql in MIGRATIONS:
+            if target > version:
+                with self.con:
+                    self.con.execute(sql)
+                    self.con.execute(f'PRAGMA user_version = {target}')
+
+    def get_hash(self, path, size, mtime):
+        """Return the hash stored for a file or None if it changed."""
+        with self.lock:
+            row = self.con.execute(
+                'SELECT hash FROM files WHERE path = ? AND size = ? '
+                'AND mtime = ?', (path, size, mtime)).fetchone()
+        if row:
+            return row[0]
+
+    def put_file(self, path, size, mtime, hash):
+        self.queue('INSERT OR REPLACE INTO files VALUES (?,?,?,?)',
+            (path, size, mtime, hash))
+
+    def get_state(self, hash):
+        """Return chapter file and character position of a book or None."""
+        with self.lock:
+            row = self.con.execute(
+                'SELECT chapter, position FROM states WHERE hash = ?',
+                (hash,)).fetchone()
+        return row
+
+    def put_state(self, hash, filename, chapter, position):
+        self.queue('INSERT OR REPLACE INTO states VALUES (?,?,?,?,?)',
+            (hash, filename, chapter, position, time.time()))
+
+    def get_markers(self, hash):
+        """Return a dict of marker names to (chapter, position)."""
+        with self.lock:
+            cur = self.con.execute(
+                'SELECT name, chapter, position FROM markers WHERE hash = ?',
+                (hash,))
+            return {name: (chapter, position)
+                for name, chapter, position in cur}
+
+    def put_marker(self, hash, name, chapter, position):
+        self.queue('INSERT OR REPLACE INTO markers VALUES (?,?,?,?)',
+            (hash, name, chapter, position))
+
+    def get_history(self, hash):
+        """Return (seq, chapter, position) of all history entries, oldest
+        first."""
+        with self.lock:
+            return self.con.execute(
+                'SELECT seq, chapter, position FROM history WHERE hash = ? '
+                'ORDER BY seq', (hash,)).fetchall()
+
+    def put_history(self, hash, seq, chapter, position):
+        self.queue('INSERT OR REPLACE INTO history VALUES (?,?,?,?)',
+            (hash, seq, chapter, position))
+
+    def trim_history(self, hash, seq):
+        """Delete history entries before seq."""
+        self.queue('DELETE FROM history WHERE hash = ? AND seq < ?',
+            (hash, seq))
+
+    def queue(self, sql, args):
+        with self.queue_lock:
+            self.pending.append((sql, args))
+
+    def flush(self):
+        """Write all queued changes, return False if the database was
+        locked. Failed writes are queued again in front of newer ones."""
+        with self.lock:
+            with self.queue_lock:
+                pending, self.pending = self.pending, []
+            if not pending:
+                return True
+            try:
+                with self.con:
+                    for sql, args in pending:
+                        self.con.execute(sql, args)
+            except sqlite3.OperationalError:
+                with self.queue_lock:
+                    self.pending[:0] = pending
+                return False
+            return True
+
+    def close(self, attempts=3):
+        """Write all queued changes and close the database. Return False
+        if it stayed locked for attempts flushes and changes were lost."""
+        for _ in range(attempts):
+            written = self.flush()
+            if written:
+                break
+        with self.lock:
+            self.con.close()
+        return written
+
+class Markers():
+    """Named positions and movement history of one book.
+
+    Positions are (chapter file, character) tuples. They are read from the
+    store when they are first used, and each change is queued on the
+    store as it happens, so only changed entries are written. store may be
+    None to keep them in memory only."""
+
+    def __init__(self, store, hash, history_size=100):
+        self.store = store
+        self.hash = hash
+        self.history_size = history_size
+        self.names = None
+        self.history = None
+        self.seqs = None
+        self.index = 0
+        ## counts changes, to tell if there is anything new to save
+        self.version = 0
+
+    def load(self):
+        if self.names is not None:
+            return
+        self.names = {}
+        self.history = []
+        self.seqs = []
+        if self.store:
+            self.names = self.store.get_markers(self.hash)
+            for seq, chapter, position in self.store.get_history(self.hash):
+                self.seqs.append(seq)
+                self.history.append((chapter, position))
+        self.index = len(self.history)
+
+    def get(self, name):
+        self.load()
+        return self.names.get(name)
+
+    def set(self, name, position):
+        self.load()
+        position = tuple(position)
+        if self.names.get(name) == position:
+            return
+        self.names[name] = position
+        self.version += 1
+        if self.store:
+            self.store.put_marker(self.hash, name, *position)
+
+    def items(self):
+        self.load()
+        return self.names.items()
+
+    def record(self, position):
+        """Append position to the history."""
+        self.load()
+        position = tuple(position)
+        self.index = len(self.history)
+        if self.history and self.history[-1] == position:
+            return
+        seq = self.seqs[-1] + 1 if self.seqs else 0
+        self.history.append(position)
+        self.seqs.append(seq)
+        self.version += 1
+        if self.store:
+            self.store.put_history(self.hash, seq, *position)
+        if len(self.history) > self.history_size:
+            del self.history[0]
+            del self.seqs[0]
+            if self.store:
+                self.store.trim_history(self.hash, self.seqs[0])
+        self.index = len(self.history)
+
+    def back(self, position):
+        """Return the history entry before the current one or None.
+        position is the current position, it is recorded first if the
+        history is not being browsed already."""
+        self.load()
+        if self.index >= len(self.history):
+            self.record(position)
+            self.index = len(self.history) - 1
+        if self.index <= 0:
+            return None
+        self.index -= 1
+        return self.history[self.index]
+
+    def forward(self):
+        """Return the history entry after the current one or None."""
+        self.load()
+        if self.index + 1 >= len(self.history):
+            return None
+        self.index += 1
+        return self.history[self.index]
+
+class Autosave():
+    """Saves the reading state on a background thread.
+
+    mark is called with a function that queues the current state on a
+    store. The latest one is written every interval seconds, or as soon
+    as mark was called turns times since the last write, so the caller
+    never waits for the database."""
+
+    def __init__(self, store, interval=30, turns=20):
+        self.store = store
+        self.interval = interval
+        self.turns = turns
+        self.save = None
+        self.count = 0
+        self.stopped = False
+        self.condition = threading.Condition()
+        self.thread = threading.Thread(
+            target=self.run, name='termpub-autosave', daemon=True)
+        self.thread.start()
+
+    def mark(self, save):
+        with self.condition:
+            self.save = save
+            self.count += 1
+            if self.count >= self.turns:
+                self.condition.notify()
+
+    def run(self):
+        while True:
+            with self.condition:
+                self.condition.wait_for(
+                    lambda: self.stopped or self.count >= self.turns,
+                    timeout=self.interval)
+                if self.stopped:
+                    return
+                save, self.save = self.save, None
+                self.count = 0
+            if save:
+                save(self.store)
+                self.store.flush()
+
+    def stop(self):
+        """Stop the thread without writing the pending state."""
+        with self.condition:
+            self.stopped = True
+            self.condition.notify()
+        self.thread.join()
@@ -1,8 +1,117 @@
-import builtins
+from bisect import bisect_right
+import functools
 import unicodedata
 
+from termpub.widthtable import starts, widths
+
+def char_width(c):
+    """Number of columns needed to display the single character c."""
+    return widths[bisect_right(starts, ord(c)) - 1]
+
 def width(chunk):
-    ## TODO use wcwidth or pyicu to compute visual length if those
-    ## modules are available
-    chars = [ c for c in chunk if not unicodedata.combining(c) ]
-    return builtins.len(chars)
+    """Number of columns needed to display chunk. Combining characters
+    and zero width joiners take no space, East Asian wide characters two
+    columns."""
+    if chunk.isascii():
+        return len(chunk)
+    return _width(chunk)
+
+## Words and lines repeat a lot, so non-ascii results are cached.
+@functools.lru_cache(maxsize=4096)
+def _width(chunk):
+    total = 0
+    for c in chunk:
+        if ' ' <= c < '\x7f':
+            total += 1
+        else:
+            total += widths[bisect_right(starts, ord(c)) - 1]
+    return total
+
+def length(chunk):
+    """Number of characters in chunk, not counting combining ones."""
+    if chunk.isascii():
+        return len(chunk)
+    return len([c for c in chunk if not unicodedata.combining(c)])
+
+def cut(line, start, length):
+    """Return the part of line between the columns start and
+    start + length."""
+    if line.isascii():
+        return line[start:start + length]
+    end = start + length
+    chars = []
+    column = 0
+    keep = False
+    for c in line:
+        w = char_width(c)
+        if w == 0:
+            if keep:
+                chars.append(c)
+            continue
+        if column >= end:
+            break
+        keep = start <= column and column + w <= end
+        if keep:
+            chars.append(c)
+        elif column < start < column + w:
+            ## the visible half of a wide character
+            chars.append(' ' * (column + w - start))
+        column += w
+    return ''.join(chars)
+
+def generate_table():
+    """Return the source of termpub/widthtable.py for the unicode
+    database of the running python."""
+
+    def compute(cp):
+        c = chr(cp)
+        category = unicodedata.category(c)
+        if unicodedata.combining(c) or category in ('Mn', 'Me', 'Cc'):
+            return 0
+        if category == 'Cf' and c != '\xad':
+            return 0
+        ## Hangul jamo vowels and final consonants join the syllable
+        if 0x1160 <= cp <= 0x11ff or 0xd7b0 <= cp <= 0xd7ff:
+            return 0
+        if category == 'Cn':
+            ## unassigned code points in the CJK blocks default to wide
+            if (0x3400 <= cp <= 0x4dbf or 0x4e00 <= cp <= 0x9fff
+                    or 0xf900 <= cp <= 0xfaff or 0x20000 <= cp <= 0x3fffd):
+                return 2
+            return 1
+        if unicodedata.east_asian_width(c) in ('W', 'F'):
+            return 2
+        return 1
+
+    starts = []
+    widths = []
+    for cp in range(0x110000):
+        w = compute(cp)
+        if not widths or widths[-1] != w:
+            starts.append(cp)
+            widths.append(w)
+
+    lines = [
+        '## Generated by "python -m termpub.width" from unicode '
+            + unicodedata.unidata_version + ', do not edit.',
+        '##',
+        '## Characters from starts[n] up to starts[n + 1] are widths[n]',
+        '## columns wide.',
+        '',
+        'from array import array',
+        '',
+        "starts = array('L', [",
+    ]
+    for i in range(0, len(starts), 8):
+        lines.append(
+            '    ' + ', '.join(f'0x{x:05x}' for x in starts[i:i + 8]) + ',')
+    lines.append('])')
+    lines.append('')
+    lines.append('widths = bytes([')
+    for i in range(0, len(widths), 24):
+        lines.append('    ' + ', '.join(str(x) for x in widths[i:i + 24]) + ',')
+    lines.append('])')
+    return '\n'.join(lines) + '\n'
+
+if __name__ == '__main__':
+    print(generate_table(), end='')
@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+import os
+import tempfile
+import unittest
+
+from termpub.cache import RenderCache
+from termpub.renderer import Renderer
+
+class RenderCacheTests(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.file = os.path.join(self.dir.name, 'render.sqlite')
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def render(self):
+        return Renderer(base_url='OEBPS/c0.xhtml').render(
+            '<p id="start">Hello <a href="c1.xhtml#x">world</a></p>')
+
+    def test_roundtrip(self):
+        lines, ids, locations = self.render()
+        cache = RenderCache(self.file)
+        self.assertIsNone(cache.get('hash', 'c0', 80))
+        cache.put('hash', 'c0', 80, '', lines, ids, locations)
+        self.assertEqual(cache.get('hash', 'c0', 80), (lines, ids, locations))
+        self.assertIsNone(cache.get('hash', 'c0', 60))
+        self.assertIsNone(cache.get('hash', 'c0', 80, 'de_DE'))
+
+    def test_version(self):
+        cache = RenderCache(self.file)
+        cache.put('hash', 'c0', 80, '', *self.render())
+        cache.close()
+        version = Renderer.version
+        try:
+            Renderer.version += 1
+            cache = RenderCache(self.file)
+            self.assertIsNone(cache.get('hash', 'c0', 80))
+        finally:
+            Renderer.version = version
+
+    def test_eviction(self):
+        cache = RenderCache(self.file, max_size=1)
+        cache.put('hash', 'c0', 80, '', *self.render())
+        cache.put('hash', 'c1', 80, '', *self.render())
+        self.assertIsNone(cache.get('hash', 'c0', 80))
+
+if __name__ == '__main__':
+    unittest.main()
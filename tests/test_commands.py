@@ -0,0 +1,27 @@
+#!/usr/bin/env python3
+import unittest
+
+from termpub.commands import parse_command, parse_bool, CommandException
+
+class CommandTests(unittest.TestCase):
+
+    def test_parse_bool(self):
+        for value in ('on', 'true', 'yes', '1', 'On', True):
+            self.assertIs(parse_bool(value, 'windowed'), True)
+        for value in ('off', 'false', 'no', '0', 'OFF', False):
+            self.assertIs(parse_bool(value, 'windowed'), False)
+        with self.assertRaises(CommandException):
+            parse_bool('maybe', 'windowed')
+
+    def test_set_off(self):
+        command, key, value = parse_command('set windowed off')
+        self.assertIs(parse_bool(value, key), False)
+        command, key, value = parse_command('set windowed no')
+        self.assertIs(parse_bool(value, key), False)
+        command, key, value = parse_command('set smartcase off')
+        self.assertIs(parse_bool(value, key), False)
+        command, key, value = parse_command('set literal yes')
+        self.assertIs(parse_bool(value, key), True)
+
+if __name__ == '__main__':
+    unittest.main()
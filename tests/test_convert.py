@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+import io
+import os
+import tempfile
+import unittest
+
+from termpub.convert import convert, outputs
+from test_epub import make_epub
+
+class ConvertTests(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.books = os.path.join(self.dir.name, 'books')
+        os.makedirs(os.path.join(self.books, 'sub'))
+        make_epub(os.path.join(self.books, 'one.epub'), [
+            '<h1>One</h1><p>See <a href="c1.xhtml#x">there</a>.</p>',
+            '<p id="x">two</p>'])
+        make_epub(os.path.join(self.books, 'sub', 'two.epub'), ['<p>x</p>'])
+        with open(os.path.join(self.books, 'bad.epub'), 'w') as fh:
+            fh.write('not a zip file')
+        self.out = os.path.join(self.dir.name, 'out')
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def read(self, name):
+        with open(os.path.join(self.out, name)) as fh:
+            return fh.read()
+
+    def test_outputs(self):
+        self.assertEqual(
+            sorted(outputs([self.books], '.txt', self.out)),
+            [(os.path.join(self.books, 'bad.epub'),
+                os.path.join(self.out, 'bad.txt')),
+            (os.path.join(self.books, 'one.epub'),
+                os.path.join(self.out, 'one.txt')),
+            (os.path.join(self.books, 'sub', 'two.epub'),
+                os.path.join(self.out, 'sub', 'two.txt'))])
+
+    def test_convert(self):
+        report = io.StringIO()
+        books = list(outputs([self.books], '.txt', self.out))
+        self.assertEqual(convert(books, out=report), 1)
+        self.assertIn('3 books, 1 failed', report.getvalue())
+        self.assertEqual(self.read('one.txt'),
+            '= One\n\nSee [1]there.\n\n[1] OEBPS/c1.xhtml#x\n\ntwo\n')
+        self.assertEqual(self.read('sub/two.txt'), 'x\n')
+        self.assertFalse(os.path.exists(os.path.join(self.out, 'bad.txt')))
+
+    def test_markdown(self):
+        books = list(outputs([self.books], '.md', self.out))
+        convert(books, jobs=2, out=io.StringIO(), format='markdown')
+        self.assertEqual(self.read('one.md'),
+            '# One\n\nSee [1]there.\n\n[1]: <OEBPS/c1.xhtml#x>\n\ntwo\n')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,37 @@
+#!/usr/bin/env python3
+import io
+import os
+import tempfile
+import unittest
+
+from termpub.dump import dump
+from termpub.epub import Epub
+from test_epub import make_epub
+
+class DumpTests(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.file = os.path.join(self.dir.name, 'book.epub')
+        ## more chapters than the pool keeps in flight, so results of
+        ## several rounds have to be put back in order
+        make_epub(self.file, [
+            f'<h1>Chapter {n}</h1>' + f'<p>Text of chapter {n}.</p>' * n
+            for n in range(10)])
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def dump(self, jobs):
+        out = io.StringIO()
+        dump(Epub(self.file), width=40, jobs=jobs, out=out)
+        return out.getvalue()
+
+    def test_jobs(self):
+        serial = self.dump(1)
+        self.assertIn('Chapter 9', serial)
+        self.assertLess(serial.index('Chapter 1'), serial.index('Chapter 2'))
+        self.assertEqual(self.dump(2), serial)
+
+if __name__ == '__main__':
+    unittest.main()
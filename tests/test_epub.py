@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+import gc
+import mmap
+import os
+import tempfile
+import unittest
+import weakref
+import zipfile
+
+from termpub.epub import Epub, MemberCache
+
+CONTAINER = '''<?xml version="1.0"?>
+<container version="1.0"
+    xmlns="urn:oasis:names:tc:opendocument:xmlns:container">
+  <rootfiles>
+    <rootfile full-path="OEBPS/content.opf"
+        media-type="application/oebps-package+xml"/>
+  </rootfiles>
+</container>'''
+
+def make_epub(file, chapters, compression=zipfile.ZIP_STORED, language=None):
+    items = ''
+    spine = ''
+    metadata = ''
+    if language:
+        metadata = f'<dc:language>{language}</dc:language>'
+    for index in range(len(chapters)):
+        items += (f'<item id="c{index}" href="c{index}.xhtml" '
+            'media-type="application/xhtml+xml"/>')
+        spine += f'<itemref idref="c{index}"/>'
+
+    with zipfile.ZipFile(file, 'w', compression) as zip:
+        zip.writestr('mimetype', 'application/epub+zip')
+        zip.writestr('META-INF/container.xml', CONTAINER)
+        zip.writestr('OEBPS/content.opf', f'''<?xml version="1.0"?>
+            <package xmlns="http://www.idpf.org/2007/opf" version="3.0">
+              <metadata xmlns:dc="http://purl.org/dc/elements/1.1/">
+                <dc:title>Title</dc:title>
+                <dc:creator>Author</dc:creator>
+                {metadata}
+              </metadata>
+              <manifest>{items}</manifest>
+              <spine>{spine}</spine>
+            </package>''')
+        for index, body in enumerate(chapters):
+            zip.writestr(f'OEBPS/c{index}.xhtml',
+                f'<html><body>{body}</body></html>')
+
+class EpubTests(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.file = os.path.join(self.dir.name, 'test.epub')
+        make_epub(self.file, ['<p>one</p>', '<p>two</p>', '<p>three</p>'])
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_metadata(self):
+        epub = Epub(self.file)
+        self.assertEqual(epub.title, 'Title')
+        self.assertEqual(epub.author, 'Author')
+
+    def test_language(self):
+        self.assertIsNone(Epub(self.file).language)
+        make_epub(self.file, ['<p>eins</p>'], language='de')
+        self.assertEqual(Epub(self.file).language, 'de')
+
+    def test_lazy_chapters(self):
+        epub = Epub(self.file)
+        chapters = epub.chapters
+        self.assertEqual(
+            [c.file for c in chapters],
+            ['OEBPS/c0.xhtml', 'OEBPS/c1.xhtml', 'OEBPS/c2.xhtml'])
+        self.assertTrue(all(c._source is None for c in chapters))
+        self.assertIn('<p>two</p>', chapters[1].source)
+        self.assertIsNotNone(chapters[1]._source)
+        self.assertIsNone(chapters[0]._source)
+
+    def test_source_cache(self):
+        epub = Epub(self.file, cache_size=2)
+        chapters = epub.chapters
+        for chapter in chapters:
+            self.assertIn('<p>', chapter.source)
+        self.assertEqual(
+            list(epub.source_cache.entries),
+            ['OEBPS/c1.xhtml', 'OEBPS/c2.xhtml'])
+        self.assertIn('<p>one</p>', chapters[0].source)
+        self.assertEqual(
+            list(epub.source_cache.entries),
+            ['OEBPS/c2.xhtml', 'OEBPS/c0.xhtml'])
+
+    def test_hash(self):
+        epub = Epub(self.file)
+        hash = epub.hash()
+        self.assertIs(epub.hash(), hash)
+        self.assertEqual(Epub(self.file).hash(), hash)
+
+        make_epub(self.file, ['<p>changed</p>'])
+        self.assertNotEqual(Epub(self.file).hash(), hash)
+
+    def test_fingerprint(self):
+        epub = Epub(self.file)
+        path, size, mtime = epub.fingerprint()
+        self.assertEqual(path, os.path.abspath(self.file))
+        self.assertEqual(size, os.path.getsize(self.file))
+
+        os.utime(self.file, ns=(0, mtime + 10**9))
+        self.assertNotEqual(Epub(self.file).fingerprint(), (path, size, mtime))
+
+    def test_members(self):
+        make_epub(self.file, ['<p>one</p>'], zipfile.ZIP_DEFLATED)
+        epub = Epub(self.file)
+        reads = []
+        read = epub.zip.read
+        epub.zip.read = lambda name: reads.append(name) or read(name)
+
+        epub.toc
+        epub.toc
+        self.assertEqual(reads, ['OEBPS/content.opf'])
+
+        ## chapters keep their decoded source, not the bytes
+        self.assertIn('one', epub.chapters[0].source)
+        self.assertNotIn('OEBPS/c0.xhtml', epub.members.entries)
+
+        self.assertEqual(epub.read('OEBPS/c0.xhtml'),
+            b'<html><body><p>one</p></body></html>')
+        self.assertEqual(bytes(epub.view('OEBPS/c0.xhtml')[:6]), b'<html>')
+        self.assertEqual(reads,
+            ['OEBPS/content.opf', 'OEBPS/c0.xhtml', 'OEBPS/c0.xhtml'])
+
+    def test_mapped(self):
+        os.chmod(self.file, 0o444)
+        epub = Epub(self.file)
+        view = epub.view('OEBPS/c1.xhtml')
+        self.assertIsInstance(view.obj, mmap.mmap)
+        self.assertEqual(bytes(view), b'<html><body><p>two</p></body></html>')
+        self.assertEqual(epub.read('OEBPS/c1.xhtml'), bytes(view))
+
+        os.chmod(self.file, 0o644)
+        self.assertIsNone(Epub(self.file).mapped('OEBPS/c1.xhtml'))
+
+        make_epub(self.file, ['<p>one</p>'], zipfile.ZIP_DEFLATED)
+        os.chmod(self.file, 0o444)
+        epub = Epub(self.file)
+        self.assertIsNone(epub.mapped('OEBPS/c0.xhtml'))
+        self.assertIn(b'one', bytes(epub.view('OEBPS/c0.xhtml')))
+
+    def test_read_checks_crc(self):
+        epub = Epub(self.file)
+        reads = []
+        read = epub.zip.read
+        epub.zip.read = lambda name: reads.append(name) or read(name)
+        self.assertIn(b'two', epub.read('OEBPS/c1.xhtml'))
+        self.assertEqual(reads, ['OEBPS/c1.xhtml'])
+
+    def test_changed_file(self):
+        os.chmod(self.file, 0o444)
+        epub = Epub(self.file)
+        self.assertIsNotNone(epub.mapped('OEBPS/c1.xhtml'))
+
+        stat = os.stat(self.file)
+        os.utime(self.file, ns=(0, stat.st_mtime_ns + 10**9))
+        self.assertIsNone(epub.mapped('OEBPS/c1.xhtml'))
+        self.assertIsInstance(epub.view('OEBPS/c1.xhtml').obj, bytes)
+
+        ## truncated in place, a mapping would kill the process
+        epub = Epub(self.file)
+        os.chmod(self.file, 0o644)
+        with open(self.file, 'r+b') as fh:
+            fh.truncate(100)
+        self.assertIsNone(epub.mapped('OEBPS/c1.xhtml'))
+        try:
+            view = epub.view('OEBPS/c2.xhtml')
+        except zipfile.BadZipFile:
+            pass
+        else:
+            self.assertNotIsInstance(view.obj, mmap.mmap)
+
+    def test_export(self):
+        epub = Epub(self.file)
+        directory = os.path.join(self.dir.name, 'resources')
+        path = epub.export('OEBPS/c1.xhtml', directory)
+        self.assertEqual(path, os.path.join(directory, 'OEBPS', 'c1.xhtml'))
+        with open(path, 'rb') as fh:
+            self.assertEqual(fh.read(), epub.read('OEBPS/c1.xhtml'))
+
+        os.utime(path, ns=(0, 0))
+        self.assertEqual(epub.export('OEBPS/c1.xhtml', directory), path)
+        self.assertEqual(os.stat(path).st_mtime_ns, 0)
+
+    def test_member_cache(self):
+        cache = MemberCache(10)
+        cache.put('a', b'12345')
+        cache.put('b', b'12345')
+        cache.get('a')
+        cache.put('c', b'123')
+        self.assertEqual(list(cache.entries), ['a', 'c'])
+        self.assertEqual(cache.size, 8)
+        cache.put('d', b'12345678901')
+        self.assertIsNone(cache.get('d'))
+
+    def test_mimetype(self):
+        epub = Epub(self.file)
+        self.assertEqual(
+            epub.mimetype('OEBPS/c1.xhtml'), 'application/xhtml+xml')
+        self.assertIsNone(epub.mimetype('OEBPS/missing.xhtml'))
+
+    def test_collectable(self):
+        epub = Epub(self.file)
+        epub.chapters
+        epub.toc
+        ref = weakref.ref(epub)
+        del epub
+        gc.collect()
+        self.assertIsNone(ref())
+
+if __name__ == '__main__':
+    unittest.main()
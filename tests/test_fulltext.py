@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+import os
+import tempfile
+import unittest
+
+from termpub.fulltext import FulltextIndex, update
+from test_epub import make_epub
+
+class FulltextTests(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.books = os.path.join(self.dir.name, 'books')
+        os.makedirs(self.books)
+        self.one = os.path.join(self.books, 'one.epub')
+        self.two = os.path.join(self.books, 'two.epub')
+        make_epub(self.one, ['<p>alpha beta</p><p>gamma</p>', '<p>delta</p>'])
+        make_epub(self.two, ['<p>beta epsilon</p>'])
+        self.catalog = os.path.join(self.dir.name, 'library.sqlite')
+        self.index = FulltextIndex(os.path.join(self.dir.name, 'fts.sqlite'))
+
+    def tearDown(self):
+        self.index.close()
+        self.dir.cleanup()
+
+    def test_search(self):
+        self.assertEqual(update(self.index, [self.books], self.catalog),
+            (2, 0))
+        self.assertEqual(
+            self.index.search('gamma'),
+            [(self.one, 'OEBPS/c0.xhtml', 2, 11, 'gamma')])
+        self.assertEqual(
+            sorted(x[0] for x in self.index.search('beta')),
+            [self.one, self.two])
+        self.assertEqual(self.index.search('zeta'), [])
+
+    def test_update(self):
+        update(self.index, [self.books], self.catalog)
+        self.assertEqual(update(self.index, [self.books], self.catalog),
+            (0, 0))
+
+        make_epub(self.two, ['<p>zeta</p>'])
+        self.assertEqual(update(self.index, [self.books], self.catalog),
+            (1, 0))
+        self.assertEqual(self.index.search('epsilon'), [])
+        self.assertEqual(len(self.index.search('zeta')), 1)
+
+        os.remove(self.two)
+        update(self.index, [self.books], self.catalog)
+        self.assertEqual(self.index.search('zeta'), [])
+
+    def test_delete_by_rowid(self):
+        self.index.put('a', '/a.epub', 80, [('one', 'c0', 0, 1)] * 3)
+        self.index.put('b', '/b.epub', 80, [('two', 'c0', 0, 1)] * 2)
+        self.index.put('a', '/a.epub', 80, [('three', 'c0', 0, 1)])
+        self.index.put('c', '/c.epub', 80, [])
+        count = self.index.con.execute(
+            'SELECT COUNT(*) FROM lines').fetchone()[0]
+        self.assertEqual(count, 3)
+        self.assertEqual(self.index.search('one'), [])
+        self.assertEqual(len(self.index.search('two')), 2)
+        self.index.con.execute("UPDATE books SET path = '/gone.epub'")
+        self.index.prune()
+        count = self.index.con.execute(
+            'SELECT COUNT(*) FROM lines').fetchone()[0]
+        self.assertEqual(count, 0)
+
+    def test_reindex(self):
+        lines = [(f'line{n}', 'c0', n, 1) for n in range(5)]
+        for _ in range(2):
+            self.index.put('a', '/a.epub', 80, [('alpha', 'c0', 0, 1)] * 4)
+            self.index.put('b', '/b.epub', 80, lines)
+            self.index.put('c', '/c.epub', 80, [('gamma', 'c0', 0, 1)] * 2)
+        rows = self.index.con.execute(
+            'SELECT hash, COUNT(*) FROM lines GROUP BY hash').fetchall()
+        self.assertEqual(rows, [('a', 4), ('b', 5), ('c', 2)])
+        self.assertEqual(
+            sorted(x[2] for x in self.index.search('line3 OR line4')), [3, 4])
+        ranges = self.index.con.execute(
+            'SELECT first, last FROM books ORDER BY first').fetchall()
+        self.assertEqual([y - x + 1 for x, y in ranges], [4, 5, 2])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+import os
+import tempfile
+import unittest
+
+from termpub.hyphenation import Hyphenator
+from termpub.renderer import Renderer
+
+class FakeDictionary():
+
+    def __init__(self):
+        self.calls = 0
+
+    def iterate(self, word):
+        self.calls += 1
+        for i in range(len(word) - 2, 1, -1):
+            yield word[:i], word[i:]
+
+class HyphenatorTests(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.file = os.path.join(self.dir.name, 'hyphenation.sqlite')
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def hyphenator(self, version='1.0', dic=True, **kwargs):
+        hyphenator = Hyphenator('xx', **kwargs)
+        hyphenator.dic = FakeDictionary() if dic else None
+        hyphenator.loaded = True
+        hyphenator.version = version
+        return hyphenator
+
+    def test_split(self):
+        hyphenator = self.hyphenator()
+        self.assertEqual(hyphenator.split('abcdefg', 5), ('abcd', 'efg'))
+        self.assertEqual(hyphenator.split('abcdefg', 3), ('ab', 'cdefg'))
+        self.assertIsNone(hyphenator.split('abcdefg', 2))
+        self.assertEqual(hyphenator.dic.calls, 1)
+
+    def test_lru(self):
+        hyphenator = self.hyphenator(cache_size=1)
+        hyphenator.pairs('abcdefg')
+        hyphenator.pairs('hijklmn')
+        hyphenator.pairs('abcdefg')
+        self.assertEqual(hyphenator.dic.calls, 3)
+
+    def test_persistence(self):
+        hyphenator = self.hyphenator(file=self.file)
+        pairs = hyphenator.pairs('abcdefg')
+        hyphenator.close()
+        hyphenator = self.hyphenator(file=self.file)
+        self.assertEqual(hyphenator.pairs('abcdefg'), pairs)
+        self.assertEqual(hyphenator.dic.calls, 0)
+
+    def test_no_dictionary(self):
+        hyphenator = self.hyphenator(file=self.file, dic=False)
+        self.assertEqual(hyphenator.pairs('abcdefg'), ())
+        hyphenator.close()
+        hyphenator = self.hyphenator(file=self.file)
+        self.assertEqual(hyphenator.pairs('abcdefg')[0], ('abcde', 'fg'))
+        self.assertEqual(hyphenator.dic.calls, 1)
+
+    def test_version(self):
+        hyphenator = self.hyphenator(file=self.file)
+        hyphenator.pairs('abcdefg')
+        hyphenator.close()
+        hyphenator = self.hyphenator(file=self.file, version='2.0')
+        hyphenator.pairs('abcdefg')
+        self.assertEqual(hyphenator.dic.calls, 1)
+
+    def test_renderer(self):
+        hyphenator = self.hyphenator()
+        lines, _, _ = Renderer(10, dic=hyphenator).render(
+            '<p>abc defghijklm</p>')
+        self.assertEqual(lines, ['abc defgh-', 'ijklm'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+import json
+import os
+import tempfile
+import unittest
+
+from termpub.library import Catalog, scan
+from test_epub import make_epub
+
+class LibraryTests(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.books = os.path.join(self.dir.name, 'books')
+        os.makedirs(os.path.join(self.books, 'sub'))
+        make_epub(self.path('one.epub'), ['<p>one</p>', '<p>two</p>'])
+        make_epub(self.path('sub/two.epub'), ['<p>one</p>'])
+        with open(self.path('sub/bad.epub'), 'w') as fh:
+            fh.write('not a zip file')
+        self.catalog = Catalog(os.path.join(self.dir.name, 'library.sqlite'))
+
+    def tearDown(self):
+        self.catalog.close()
+        self.dir.cleanup()
+
+    def path(self, name):
+        return os.path.join(self.books, name)
+
+    def test_scan(self):
+        self.assertEqual(scan(self.catalog, [self.books]), (3, 0, 1))
+        self.assertEqual(scan(self.catalog, [self.books]), (0, 0, 0))
+
+        os.utime(self.path('one.epub'), ns=(0, 10**9))
+        os.remove(self.path('sub/two.epub'))
+        self.assertEqual(scan(self.catalog, [self.books]), (1, 1, 0))
+
+    def test_books(self):
+        scan(self.catalog, [self.books], jobs=2)
+        ## listing only reads the catalog
+        os.remove(self.path('one.epub'))
+
+        books = self.catalog.books()
+        self.assertEqual(
+            sorted(x['path'] for x in books),
+            [self.path('one.epub'), self.path('sub/two.epub')])
+        self.assertEqual(len(self.catalog.books('auth')), 2)
+        self.assertEqual(len(self.catalog.books(title='nothing')), 0)
+
+        book = self.catalog.book(self.path('one.epub'))
+        self.assertEqual(book['title'], 'Title')
+        self.assertEqual(book['author'], 'Author')
+        self.assertEqual(book['chapters'], 2)
+        self.assertEqual(len(book['hash']), 128)
+        self.assertEqual(json.loads(book['toc']), [])
+
+        bad = self.catalog.book(self.path('sub/bad.epub'))
+        self.assertIsNotNone(bad['error'])
+
+if __name__ == '__main__':
+    unittest.main()
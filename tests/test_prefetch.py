@@ -0,0 +1,36 @@
+#!/usr/bin/env python3
+import threading
+import unittest
+
+from termpub.prefetch import Prefetcher
+
+class PrefetcherTests(unittest.TestCase):
+
+    def setUp(self):
+        self.prefetcher = Prefetcher()
+
+    def tearDown(self):
+        self.prefetcher.shutdown()
+
+    def test_take(self):
+        self.prefetcher.schedule('a', lambda x: x * 2, 21)
+        self.assertEqual(self.prefetcher.take('a'), 42)
+        self.assertIsNone(self.prefetcher.take('a'))
+        self.assertIsNone(self.prefetcher.take('b'))
+
+    def test_error(self):
+        self.prefetcher.schedule('a', lambda: 1 / 0)
+        self.assertIsNone(self.prefetcher.take('a'))
+
+    def test_retain(self):
+        event = threading.Event()
+        self.prefetcher.schedule('block', event.wait)
+        self.prefetcher.schedule('a', lambda: 'a')
+        self.prefetcher.schedule('b', lambda: 'b')
+        self.prefetcher.retain(['b'])
+        event.set()
+        self.assertIsNone(self.prefetcher.take('a'))
+        self.assertEqual(self.prefetcher.take('b'), 'b')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+import unittest
+
+from termpub.reader import RenderedChapter
+from termpub.renderer import Renderer
+
+class RenderedChapterTests(unittest.TestCase):
+
+    def test_offsets(self):
+        chapter = RenderedChapter(['abc', '', 'de', 'f'])
+        self.assertEqual(chapter.character_offset(0), 0)
+        self.assertEqual(chapter.character_offset(2), 3)
+        self.assertEqual(chapter.character_offset(3), 5)
+        self.assertEqual(chapter.character_offset(10), 6)
+        self.assertEqual(chapter.find_character(1), 0)
+        self.assertEqual(chapter.find_character(3), 0)
+        self.assertEqual(chapter.find_character(4), 2)
+        self.assertEqual(chapter.find_character(6), 3)
+        self.assertIsNone(chapter.find_character(7))
+
+    def test_incremental(self):
+        source = ''.join(f'<p>paragraph {i}</p>' for i in range(100))
+        chapter = RenderedChapter(renderer=Renderer(), source=source)
+        chapter.extend(10)
+        self.assertIsNone(chapter.find_character(1000))
+        chapter.extend()
+        line = chapter.find_character(1000)
+        self.assertLess(chapter.character_offset(line), 1000)
+        self.assertGreaterEqual(chapter.character_offset(line + 1), 1000)
+        self.assertEqual(chapter.character_offset(line + 1),
+            sum(len(x) for x in chapter.lines[:line + 1]))
+
+    def test_restart(self):
+        ## the error is in the second chunk the renderer parses
+        source = ('<body>' + '<p>paragraph</p>' * 5000
+            + '<p>stray & ampersand</p></body>')
+        chapter = RenderedChapter(renderer=Renderer(), source=source)
+        lines = chapter.lines
+        chapter.extend(4)
+        self.assertIs(chapter.lines, lines)
+        chapter.extend()
+        self.assertEqual(chapter.restarts, 1)
+        self.assertEqual(chapter.lines,
+            Renderer(parser='html').render(source)[0])
+        self.assertEqual(chapter.character_offset(len(chapter.lines)),
+            sum(len(line) for line in chapter.lines))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -30,6 +30,80 @@ class RendererTests(unittest.TestCase):
             else:
                 input += line + "\n"
         self.assertEqual(self.renderer.render(input)[0],output)
+
+    def test_parsers(self):
+        html = ('<?xml version="1.0" encoding="utf-8"?>'
+            '<html xmlns="http://www.w3.org/1999/xhtml" '
+            'xmlns:epub="http://www.idpf.org/2007/ops"><head><title>t</title>'
+            '<style>p > b { }</style></head><body>'
+            '<h2 id="a" epub:type="title">one <a href="b.html">two</a></h2>'
+            '<p>x<!-- c --> y &amp; z<br/>w</p>'
+            '<script><p>hidden</p></script><pre>a\n  b</pre></body></html>')
+        self.assertEqual(Renderer(parser='xml').render(html),
+            Renderer(parser='html').render(html))
+        self.assertEqual(Renderer(parser='xml').render(html)[0],
+            ['== one [1]two', '', 'x y & z', 'w', '', 'a', '  b'])
+
+    def test_xhtml_entities(self):
+        html = ('<?xml version="1.0" encoding="utf-8"?>'
+            '<!DOCTYPE html PUBLIC "-//W3C//DTD XHTML 1.1//EN" '
+            '"http://www.w3.org/TR/xhtml11/DTD/xhtml11.dtd">'
+            '<html xmlns="http://www.w3.org/1999/xhtml"><body>'
+            '<p>a&nbsp;b &eacute;</p></body></html>')
+        self.assertEqual(Renderer().render(html)[0], ['a b é'])
+        self.assertEqual(Renderer(parser='xml').render(html),
+            Renderer(parser='html').render(html))
+
+    def test_fallback(self):
+        ## the error is found after lines were yielded
+        html = ''.join(f'<p id="p{i}"><a href="{i}.html">{i}</a></p>'
+            for i in range(20)) + '<p>a &nbsp; b<br></p><p>end</p>'
+        events = list(Renderer().events(html, chunk_size=16))
+        self.assertEqual(events[0][1].path, '0.html')
+        restart = events.index(('restart',))
+        self.assertEqual(events[restart + 1:],
+            list(Renderer(parser='html').events(html, chunk_size=16)))
+
+    def test_restart(self):
+        ## html.parser drops the CDATA section that expat rendered, so
+        ## nothing of the first parse may be kept
+        html = ('<body><p>one</p><p><![CDATA[alpha beta gamma delta]]></p>'
+            + '<p>two</p>' * 5 + '<p>three & four</p><p>five</p></body>')
+        expected = Renderer(20, parser='html').render(html)
+        self.assertEqual(expected[0][-3:], ['three & four', '', 'five'])
+        events = list(Renderer(20).events(html, chunk_size=8))
+        self.assertIn(('line', 'alpha beta gamma'), events)
+        self.assertEqual(events.count(('restart',)), 1)
+        self.assertEqual(Renderer(20).render(html), expected)
+
+    def test_incremental(self):
+        html = '<p>first</p>' + '<p>more text</p>' * 10000
+        renderer = Renderer()
+        events = renderer.events(html, chunk_size=1024)
+        self.assertEqual(next(events), ('line', 'first'))
+        self.assertLess(renderer.progress, 0.1)
+
+    def test_optimal_fill(self):
+        html = '<p>aaa bb cc ddddd</p><p>averyverylongword x</p>'
+        self.assertEqual(Renderer(6).render(html)[0],
+            ['aaa bb', 'cc', 'ddddd', '', 'averyverylongword', 'x'])
+        self.assertEqual(Renderer(6, fill='optimal').render(html)[0],
+            ['aaa', 'bb cc', 'ddddd', '', 'averyverylongword', 'x'])
+
+    def test_events(self):
+        html = ('<body><p id="a">one <a href="b.html#x">two</a></p>'
+            '<h1 id="b">three</h1><p><img src="c.png" alt="c"/></p><p></p>'
+            '</body>')
+        events = list(Renderer(base_url='a.html').events(html, chunk_size=1))
+        lines = [e[1] for e in events if e[0] == 'line']
+        self.assertEqual(lines, ['one [1]two', '', '= three', '', '![2][c]'])
+        ids = {e[1]: e[2] for e in events if e[0] == 'id'}
+        self.assertEqual(ids, {'a': 0, 'b': 2})
+        locations = [e[1].geturl() for e in events if e[0] == 'location']
+        self.assertEqual(locations, ['b.html#x', 'c.png'])
+        self.assertEqual(
+            Renderer(base_url='a.html').render(html),
+            (lines, ids, [e[1] for e in events if e[0] == 'location']))
                         
 
 if __name__ == '__main__':
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+import os
+import tempfile
+import unittest
+import zlib
+
+from termpub.renderer import Renderer
+from termpub.search import ChapterText, Matcher, SearchIndex
+
+class MatcherTests(unittest.TestCase):
+
+    def spans(self, pattern, text, **kwargs):
+        return list(Matcher(pattern, **kwargs).spans(text))
+
+    def test_regex(self):
+        self.assertEqual(self.spans('o+', 'foo boo'), [(1, 3), (5, 7)])
+        self.assertEqual(self.spans('O', 'foo'), [])
+        self.assertTrue(Matcher('^f').search('foo'))
+        self.assertFalse(Matcher('^o').search('foo'))
+
+    def test_smartcase(self):
+        self.assertEqual(self.spans('o', 'fOo', smartcase=True),
+            [(1, 2), (2, 3)])
+        self.assertEqual(self.spans('O', 'fOo', smartcase=True), [(1, 2)])
+
+    def test_literal(self):
+        self.assertEqual(self.spans('o.', 'fo.o.x', literal=True),
+            [(1, 3), (3, 5)])
+        self.assertEqual(self.spans('o.', 'foox', literal=True), [])
+        self.assertEqual(self.spans('a*', 'A* a*', literal=True,
+            smartcase=True), [(0, 2), (3, 5)])
+        self.assertTrue(Matcher('(', literal=True).search('a(b'))
+
+    def test_first_last(self):
+        matcher = Matcher('ab', literal=True)
+        self.assertEqual(matcher.first('abxab', 1), 3)
+        self.assertEqual(matcher.last('abxab'), 3)
+        self.assertEqual(matcher.last('abxab', 4), 0)
+        self.assertIsNone(matcher.last('abxab', 1))
+        self.assertEqual(Matcher('a.').last('abxab', 4), 0)
+
+class ChapterTextTests(unittest.TestCase):
+
+    def setUp(self):
+        self.text = ChapterText(['foo', '', 'bar foo', 'baz'])
+
+    def test_find_next(self):
+        self.assertEqual(self.text.find_next(Matcher('foo')), 0)
+        self.assertEqual(self.text.find_next(Matcher('foo'), 0), 2)
+        self.assertIsNone(self.text.find_next(Matcher('foo'), 2))
+        self.assertEqual(self.text.find_next(Matcher('^baz')), 3)
+
+    def test_find_prev(self):
+        self.assertEqual(self.text.find_prev(Matcher('foo')), 2)
+        self.assertEqual(self.text.find_prev(Matcher('foo'), 2), 0)
+        self.assertIsNone(self.text.find_prev(Matcher('foo'), 0))
+        self.assertIsNone(self.text.find_prev(Matcher('baz'), 3))
+
+class SearchIndexTests(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.file = os.path.join(self.dir.name, 'search.sqlite')
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_persistence(self):
+        index = SearchIndex('hash', '', self.file)
+        self.assertIsNone(index.get(80, 'c0'))
+        index.add(80, 'c0', ['foo', 'bar'])
+        index.close()
+
+        index = SearchIndex('hash', '', self.file)
+        self.assertEqual(index.get(80, 'c0').find_next(Matcher('bar')), 1)
+        self.assertIsNone(index.get(60, 'c0'))
+        self.assertIsNone(SearchIndex('hash', 'de', self.file).get(80, 'c0'))
+
+    def test_version(self):
+        index = SearchIndex('hash', '', self.file)
+        index.add(80, 'c0', ['foo'])
+        index.close()
+        version = Renderer.version
+        try:
+            Renderer.version += 1
+            index = SearchIndex('hash', '', self.file)
+            self.assertIsNone(index.get(80, 'c0'))
+        finally:
+            Renderer.version = version
+
+    def test_eviction(self):
+        ## room for one text only
+        size = len(zlib.compress(b'foo'))
+        index = SearchIndex('old', '', self.file, max_size=size)
+        index.add(80, 'c0', ['foo'])
+        index.close()
+        index = SearchIndex('new', '', self.file, max_size=size)
+        index.add(80, 'c0', ['bar'])
+        index.close()
+        self.assertIsNone(SearchIndex('old', '', self.file).get(80, 'c0'))
+        self.assertIsNotNone(SearchIndex('new', '', self.file).get(80, 'c0'))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,31 @@
+#!/usr/bin/env python3
+import os
+import subprocess
+import sys
+import unittest
+
+HEAVY = ('curses', 'sqlite3', 'tempfile', 'xml.dom.minidom',
+    'concurrent.futures', 'pyphen', 'termpub.reader', 'termpub.pager')
+
+def imported(module):
+    code = f'import sys, {module}; print(" ".join(sys.modules))'
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = {**os.environ, 'PYTHONPATH': root}
+    out = subprocess.run([sys.executable, '-c', code], env=env,
+        check=True, stdout=subprocess.PIPE, universal_newlines=True).stdout
+    return set(out.split())
+
+class StartupTests(unittest.TestCase):
+
+    def test_main(self):
+        modules = imported('termpub.__main__')
+        for module in HEAVY:
+            self.assertNotIn(module, modules)
+
+    def test_dump(self):
+        modules = imported('termpub.dump')
+        for module in HEAVY:
+            self.assertNotIn(module, modules)
+
+if __name__ == '__main__':
+    unittest.main()
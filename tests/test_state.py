@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import unittest
+
+from termpub.state import StateStore, Autosave, Markers, MIGRATIONS
+
+class StateStoreTests(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.file = os.path.join(self.dir.name, 'termpub.sqlite')
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_state(self):
+        store = StateStore(self.file)
+        self.assertIsNone(store.get_state('abc'))
+        store.put_state('abc', '/book.epub', 'c1.xhtml', 42)
+        store.put_file('/book.epub', 100, 200, 'abc')
+        self.assertIsNone(store.get_state('abc'))
+        self.assertTrue(store.flush())
+        self.assertEqual(store.get_state('abc'), ('c1.xhtml', 42))
+        store.close()
+
+        store = StateStore(self.file)
+        self.assertEqual(store.get_state('abc'), ('c1.xhtml', 42))
+        self.assertEqual(store.get_hash('/book.epub', 100, 200), 'abc')
+        self.assertIsNone(store.get_hash('/book.epub', 100, 201))
+        store.close()
+
+    def test_markers(self):
+        store = StateStore(self.file)
+        store.put_marker('abc', 'a', 'c1.xhtml', 42)
+        store.put_marker('abc', "'", 'c2.xhtml', 1)
+        store.put_marker('abc', 'a', 'c3.xhtml', 7)
+        store.put_marker('def', 'a', 'c1.xhtml', 1)
+        store.flush()
+        self.assertEqual(store.get_markers('abc'),
+            {'a': ('c3.xhtml', 7), "'": ('c2.xhtml', 1)})
+        store.close()
+
+    def test_marker_objects(self):
+        store = StateStore(self.file)
+        markers = Markers(store, 'abc')
+        self.assertIsNone(markers.names)
+        markers.set('a', ('c1.xhtml', 42))
+        version = markers.version
+        markers.set('a', ('c1.xhtml', 42))
+        self.assertEqual(markers.version, version)
+        self.assertEqual(len(store.pending), 1)
+        store.close()
+
+        store = StateStore(self.file)
+        markers = Markers(store, 'abc')
+        self.assertEqual(markers.get('a'), ('c1.xhtml', 42))
+        store.close()
+
+    def test_history(self):
+        store = StateStore(self.file)
+        markers = Markers(store, 'abc', history_size=3)
+        for position in range(5):
+            markers.record(('c1.xhtml', position))
+        self.assertEqual(markers.forward(), None)
+        self.assertEqual(markers.back(('c2.xhtml', 0)), ('c1.xhtml', 4))
+        self.assertEqual(markers.back(('c1.xhtml', 4)), ('c1.xhtml', 3))
+        self.assertEqual(markers.back(('c1.xhtml', 3)), None)
+        self.assertEqual(markers.forward(), ('c1.xhtml', 4))
+        self.assertEqual(markers.forward(), ('c2.xhtml', 0))
+        self.assertEqual(markers.forward(), None)
+        store.close()
+
+        store = StateStore(self.file)
+        markers = Markers(store, 'abc', history_size=3)
+        self.assertEqual(markers.back(('c2.xhtml', 0)), ('c1.xhtml', 4))
+        self.assertEqual(
+            [x[0] for x in store.get_history('abc')], [3, 4, 5])
+        store.close()
+
+    def test_autosave(self):
+        store = StateStore(self.file)
+        written = threading.Event()
+        def save(position):
+            def write(store):
+                store.put_state('abc', '/book.epub', 'c1.xhtml', position)
+                written.set()
+            return write
+
+        autosave = Autosave(store, interval=60, turns=2)
+        autosave.mark(save(1))
+        self.assertFalse(written.wait(0.1))
+        autosave.mark(save(2))
+        self.assertTrue(written.wait(5))
+        autosave.stop()
+        self.assertEqual(store.get_state('abc'), ('c1.xhtml', 2))
+
+        written.clear()
+        autosave = Autosave(store, interval=0.05, turns=100)
+        autosave.mark(save(3))
+        self.assertTrue(written.wait(5))
+        autosave.stop()
+        self.assertEqual(store.get_state('abc'), ('c1.xhtml', 3))
+        store.close()
+
+    def test_settings(self):
+        store = StateStore(self.file)
+        mode = store.con.execute('PRAGMA journal_mode').fetchone()[0]
+        self.assertEqual(mode, 'wal')
+        version = store.con.execute('PRAGMA user_version').fetchone()[0]
+        self.assertEqual(version, MIGRATIONS[-1][0])
+        store.close()
+
+    def test_migration(self):
+        con = sqlite3.connect(self.file)
+        with con:
+            con.execute(MIGRATIONS[0][1])
+            con.execute('PRAGMA user_version = 2')
+            con.execute('INSERT INTO states VALUES (?,?,?,?,?)',
+                ('abc', '/book.epub', 'c1.xhtml', 42, 0))
+        con.close()
+
+        store = StateStore(self.file)
+        self.assertEqual(store.get_state('abc'), ('c1.xhtml', 42))
+        store.put_file('/book.epub', 100, 200, 'abc')
+        self.assertTrue(store.flush())
+        store.close()
+
+    def test_locked(self):
+        store = StateStore(self.file, timeout=0.01)
+        other = sqlite3.connect(self.file)
+        other.execute('BEGIN IMMEDIATE')
+        store.put_state('abc', '/book.epub', 'c1.xhtml', 42)
+        self.assertFalse(store.flush())
+        other.rollback()
+        other.close()
+        self.assertTrue(store.flush())
+        self.assertEqual(store.get_state('abc'), ('c1.xhtml', 42))
+        store.close()
+
+    def test_queue_during_flush(self):
+        store = StateStore(self.file, timeout=0.5)
+        other = sqlite3.connect(self.file)
+        other.execute('BEGIN IMMEDIATE')
+        store.put_state('abc', '/book.epub', 'c1.xhtml', 1)
+        flush = threading.Thread(target=store.flush)
+        flush.start()
+        while store.pending:
+            time.sleep(0.001)
+        start = time.monotonic()
+        store.put_state('abc', '/book.epub', 'c1.xhtml', 2)
+        self.assertLess(time.monotonic() - start, 0.25)
+        flush.join()
+        ## the failed write stays in front of the newer one
+        self.assertEqual([args[3] for sql, args in store.pending], [1, 2])
+        other.rollback()
+        other.close()
+        self.assertTrue(store.flush())
+        self.assertEqual(store.get_state('abc'), ('c1.xhtml', 2))
+        store.close()
+
+    def test_close_locked(self):
+        store = StateStore(self.file, timeout=0.01)
+        other = sqlite3.connect(self.file)
+        other.execute('BEGIN IMMEDIATE')
+        store.put_state('abc', '/book.epub', 'c1.xhtml', 42)
+        self.assertFalse(store.close())
+        other.rollback()
+        other.close()
+        self.assertIsNone(StateStore(self.file).get_state('abc'))
+
+    def test_close_retry(self):
+        store = StateStore(self.file, timeout=0.2)
+        other = sqlite3.connect(self.file, check_same_thread=False)
+        other.execute('BEGIN IMMEDIATE')
+        store.put_state('abc', '/book.epub', 'c1.xhtml', 42)
+        ## released while close waits for its second attempt
+        timer = threading.Timer(0.3, other.rollback)
+        timer.start()
+        self.assertTrue(store.close())
+        timer.join()
+        other.close()
+        self.assertEqual(
+            StateStore(self.file).get_state('abc'), ('c1.xhtml', 42))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,29 @@
+#!/usr/bin/env python3
+import unittest
+
+from termpub.width import width, length, cut
+
+class WidthTests(unittest.TestCase):
+
+    def test_width(self):
+        self.assertEqual(width(''), 0)
+        self.assertEqual(width('abc'), 3)
+        self.assertEqual(width('café'), 4)
+        self.assertEqual(width('日本語'), 6)
+        self.assertEqual(width('ｶﾀｶﾅ'), 4)
+        self.assertEqual(width('a‍b'), 2)
+        self.assertEqual(width('가'), 2)
+
+    def test_length(self):
+        self.assertEqual(length('café'), 4)
+        self.assertEqual(length('日本語'), 3)
+
+    def test_cut(self):
+        self.assertEqual(cut('abcdef', 2, 3), 'cde')
+        self.assertEqual(cut('cafés', 3, 2), 'és')
+        self.assertEqual(cut('日本語', 2, 4), '本語')
+        self.assertEqual(cut('日本語', 1, 4), ' 本')
+        self.assertEqual(cut('日本語', 0, 3), '日')
+
+if __name__ == '__main__':
+    unittest.main()